@@ -1,21 +1,46 @@
 # These imports are part of the base Python installation, so will always work
+import collections.abc
+import concurrent.futures
+import contextlib
 import csv
 import datetime
-import importlib
+import filecmp
+import fnmatch
+import functools
+import hashlib
+import hmac
+import html
+import importlib.util
+import ipaddress
 import json
+import marshal
+import math
+import mmap
 import shutil
 import os.path
+import secrets
 import sys
+import tempfile
+import time
 import typing
+import urllib.parse
+import warnings
+import zlib
 
 
-# Check for all installable modules so we can print a nice message.
+def _find_spec(name: str) -> typing.Optional['importlib.machinery.ModuleSpec']:
+    try:
+        return importlib.util.find_spec(name)
+    except ModuleNotFoundError:
+        # The parent package does not exist
+        return None
+
+
+# Check for all installable modules so we can print a nice message. This only looks them up, without importing them
 def _check_for_packages(package_names: list[str]) -> None:
     packages_to_install = []
     for p in package_names:
-        try:
-            importlib.import_module(p)
-        except ModuleNotFoundError:
+        if _find_spec(p) is None:
             first_dot_index = p.find('.')
             packages_to_install.append(f'python3-{p}' if first_dot_index == -1 else p[:first_dot_index])
     if packages_to_install:
@@ -33,15 +58,261 @@ _check_for_packages([
     'yaml',
 ])
 
+
+def _lazy_import(name: str) -> typing.Any:
+    """Return the given module, which is only actually imported when one of its attributes is used.
+
+    Returns None if the module does not exist. This keeps commands that do not render PDFs from paying for importing
+    the PDF and template packages."""
+
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = _find_spec(name)
+    if spec is None:
+        return None
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
 # Note: we could make check_for_package actually assign to variables with the package name, but then IDE's won't give
-# code completion. So we duplicate the imports here
+# code completion. So we duplicate the imports here. YAML is needed to read the config, so it is always imported
 import argparse
-import jinja2
-import pdfkit
 import re
-import xkcdpass.xkcd_password
 import yaml
 
+if typing.TYPE_CHECKING:
+    import asyncio
+    import jinja2
+    import pdfkit
+    import PIL.Image as pil_image
+    import pypdf
+    import xkcdpass.xkcd_password as xkcd_password
+else:
+    # Only used by the reprint server
+    asyncio = _lazy_import('asyncio')
+    jinja2 = _lazy_import('jinja2')
+    pdfkit = _lazy_import('pdfkit')
+    xkcd_password = _lazy_import('xkcdpass.xkcd_password')
+    # Optional packages, only used for some features
+    pypdf = _lazy_import('pypdf')
+    pil_image = _lazy_import('PIL.Image')
+
+# Use the libyaml based loader and dumper when available, since they are a lot faster
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YamlDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# Optional packages, only used for some features
+try:
+    import resource
+except ModuleNotFoundError:
+    resource = None
+try:
+    import fcntl
+except ModuleNotFoundError:
+    fcntl = None
+# Faster JSON decoder. Imported right away since it is used from multiple threads, which lazy imports do not support
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
+
+class Profiler(object):
+    """Records timed spans around the stages of a run. Does nothing until enabled.
+
+    Every span records its wall clock and CPU time, the peak RSS of this process, the CPU time of child processes that
+    ended during the span (for example the PDF converter) and counts, like the number of accounts or pages, that the
+    code inside the span reports using `count`."""
+
+    enabled: bool
+    spans: typing.List[dict]
+    _stack: typing.List[dict]
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.spans = []
+        self._stack = []
+        self._start = 0.0
+
+    def enable(self) -> None:
+        self.enabled = True
+        self.spans = []
+        self._stack = []
+        self._start = time.perf_counter()
+
+    @staticmethod
+    def _usage() -> typing.Tuple[float, float, int]:
+        """Return the CPU time of ended child processes, their peak RSS and the peak RSS of this process in KiB"""
+
+        if resource is None:
+            return 0.0, 0, 0
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return children.ru_utime + children.ru_stime, children.ru_maxrss, \
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    @contextlib.contextmanager
+    def span(self, name: str, **counts: typing.Any) -> typing.Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+
+        span = {'name': name, 'depth': len(self._stack), 'start': round(time.perf_counter() - self._start, 6)}
+        span.update(counts)
+        self.spans.append(span)
+        self._stack.append(span)
+        children_cpu, _, _ = self._usage()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            span['wall'] = round(time.perf_counter() - wall_start, 6)
+            span['cpu'] = round(time.process_time() - cpu_start, 6)
+            children_cpu_end, children_max_rss, max_rss = self._usage()
+            span['children_cpu'] = round(children_cpu_end - children_cpu, 6)
+            span['children_max_rss_kb'] = children_max_rss
+            span['max_rss_kb'] = max_rss
+            self._stack.pop()
+
+    def count(self, **counts: typing.Any) -> None:
+        """Add the given counts to the innermost running span"""
+
+        if self.enabled and self._stack:
+            self._stack[-1].update(counts)
+
+    def add_spans(self, spans: typing.Sequence[dict], **extra: typing.Any) -> None:
+        """Add spans recorded in another process below the innermost running span"""
+
+        depth = len(self._stack)
+        for span in spans:
+            span = dict(span, depth=span['depth'] + depth)
+            span.update(extra)
+            self.spans.append(span)
+
+    def summary(self) -> str:
+        """Return a table with the spans, aggregated by the names of the span and its parents"""
+
+        rows: typing.Dict[tuple, dict] = {}
+        path = []
+        for span in self.spans:
+            del path[span['depth']:]
+            path.append(span['name'])
+            if 'wall' not in span:
+                continue
+            row = rows.setdefault(tuple(path), {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'children_cpu': 0.0,
+                                                'max_rss_kb': 0, 'accounts': 0, 'pages': 0})
+            row['calls'] += 1
+            for key in ['wall', 'cpu', 'children_cpu', 'accounts', 'pages']:
+                row[key] += span.get(key, 0)
+            row['max_rss_kb'] = max(row['max_rss_kb'], span['max_rss_kb'])
+
+        lines = [f'{"Stage":<44} {"Calls":>6} {"Wall (s)":>9} {"CPU (s)":>9} {"Child CPU":>9} {"RSS (MiB)":>9} '
+                 f'{"Accounts":>9} {"Pages":>7}']
+        for path, row in rows.items():
+            name = '  ' * (len(path) - 1) + path[-1]
+            lines.append(f'{name:<44} {row["calls"]:>6} {row["wall"]:>9.3f} {row["cpu"]:>9.3f} '
+                         f'{row["children_cpu"]:>9.3f} {row["max_rss_kb"] / 1024:>9.1f} {row["accounts"] or "":>9} '
+                         f'{row["pages"] or "":>7}')
+        return '\n'.join(lines)
+
+    def write_json(self, file: str) -> None:
+        with open(file, 'w') as json_file:
+            json.dump({'spans': self.spans}, json_file, indent=2)
+
+
+profiler = Profiler()
+
+
+def profiled(name: typing.Optional[str] = None) -> typing.Callable:
+    """Decorator to record every call of the function as a span with the given name, or the function name"""
+
+    def decorator(function: typing.Callable) -> typing.Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with profiler.span(name or function.__name__):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class WordPool(collections.abc.Sequence):
+    """Read-only pool of words to generate passwords from, shared by all accounts in the process.
+
+    Small word lists are read once into a tuple. Large dictionaries are memory-mapped instead and only the offsets of
+    the lines are kept, so even a list with hundreds of thousands of words does not need a string object per word."""
+
+    # Word lists larger than this (in bytes) are memory-mapped instead of read into memory
+    mmap_threshold: int = 1024 * 1024
+
+    _pools: typing.Dict[str, 'WordPool'] = {}
+
+    file: str
+    _words: typing.Optional[typing.Tuple[str, ...]] = None
+    _map: typing.Optional[mmap.mmap] = None
+    _offsets: typing.Optional[typing.List[int]] = None
+
+    def __init__(self, file: str) -> None:
+        self.file = file
+
+    @classmethod
+    def get(cls, file: typing.Optional[str] = None) -> 'WordPool':
+        """Get the shared pool for the given word list file, defaulting to the `wordlist` next to this script"""
+
+        if file is None:
+            file = f'{os.path.dirname(os.path.abspath(__file__))}/wordlist'
+        file = os.path.abspath(file)
+        if file not in cls._pools:
+            cls._pools[file] = WordPool(file)
+        return cls._pools[file]
+
+    def _load(self) -> None:
+        if self._words is not None or self._map is not None:
+            return
+
+        if os.path.getsize(self.file) <= self.mmap_threshold:
+            with open(self.file, 'r') as wordfile:
+                self._words = tuple(word for word in wordfile.read().splitlines() if word)
+            return
+
+        with open(self.file, 'rb') as wordfile:
+            self._map = mmap.mmap(wordfile.fileno(), 0, access=mmap.ACCESS_READ)
+        offsets = []
+        start = 0
+        size = len(self._map)
+        while start < size:
+            end = self._map.find(b'\n', start)
+            if end == -1:
+                end = size
+            # Skip empty lines, also those ending in \r\n, like the small lists do
+            if end > start and self._map[start:end] != b'\r':
+                offsets.append(start)
+            start = end + 1
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        self._load()
+        if self._words is not None:
+            return len(self._words)
+        return len(self._offsets)
+
+    def __getitem__(self, index: int) -> str:
+        self._load()
+        if self._words is not None:
+            return self._words[index]
+        start = self._offsets[index]
+        end = self._map.find(b'\n', start)
+        if end == -1:
+            end = len(self._map)
+        return self._map[start:end].decode('utf-8').rstrip('\r')
+
 
 class ContestObject(object):
     """Object representing a contest"""
@@ -77,6 +348,21 @@ class AccountTypesConfig(object):
         self.ccs = CcsConfig(**ccs)
 
 
+class SpoolConfig(object):
+    """Object representing the print spool settings from the configuration"""
+
+    folder: str
+    batch_size: int = 100
+    group_by: typing.Optional[str] = None
+
+    def __init__(self, folder: str, batch_size: typing.Optional[int] = None,
+                 group_by: typing.Optional[str] = None) -> None:
+        self.folder = folder
+        if batch_size:
+            self.batch_size = batch_size
+        self.group_by = group_by
+
+
 class GlobalSettings(object):
     """Object representing the global settings from the configuration"""
 
@@ -89,12 +375,29 @@ class GlobalSettings(object):
     page_size: str = 'A4'
     number_of_words_per_password: int = 3
     additional_account_files: typing.Sequence[str] = []
+    pdf_workers: int = 1
+    pdf_backend: str = 'native'
+    cache_folder: typing.Optional[str] = '.cache'
+    deploy_method: str = 'auto'
+    password_key_file: typing.Optional[str] = None
+    password_key_version: int = 1
+    spool: typing.Optional[SpoolConfig] = None
+    linux_password_hash: typing.Optional[str] = None
+    linux_plaintext_passwords: bool = True
+    export_formats: typing.Sequence[str] = []
 
     def __init__(self, contests_folder: typing.Optional[str] = None, footer: typing.Optional[str] = None,
                  account_types: dict = None, generate_accounts_tsv: typing.Optional[bool] = None,
                  ip_prefix: typing.Optional[bool] = None, ip_drop_prefix: typing.Optional[bool] = None,
                  page_size: str = None, number_of_words_per_password: int = None,
-                 additional_account_files: typing.Optional[typing.Sequence[str]] = None) -> None:
+                 additional_account_files: typing.Optional[typing.Sequence[str]] = None,
+                 pdf_workers: typing.Optional[int] = None, pdf_backend: typing.Optional[str] = None,
+                 cache_folder: typing.Optional[str] = '.cache', deploy_method: typing.Optional[str] = None,
+                 password_key_file: typing.Optional[str] = None,
+                 password_key_version: typing.Optional[int] = None, spool: typing.Optional[dict] = None,
+                 linux_password_hash: typing.Optional[str] = None,
+                 linux_plaintext_passwords: typing.Optional[bool] = None,
+                 export_formats: typing.Optional[typing.Sequence[str]] = None) -> None:
         if contests_folder:
             self.contests_folder = contests_folder
         self.footer = footer
@@ -110,6 +413,30 @@ class GlobalSettings(object):
             self.number_of_words_per_password = number_of_words_per_password
         if additional_account_files:
             self.additional_account_files = additional_account_files
+        if pdf_workers is not None:
+            self.pdf_workers = pdf_workers
+        if pdf_backend:
+            self.pdf_backend = pdf_backend
+        self.cache_folder = cache_folder
+        if deploy_method:
+            self.deploy_method = deploy_method
+        self.password_key_file = password_key_file
+        if password_key_version is not None:
+            self.password_key_version = password_key_version
+        if spool:
+            self.spool = SpoolConfig(**spool)
+        self.linux_password_hash = linux_password_hash
+        if linux_plaintext_passwords is not None:
+            self.linux_plaintext_passwords = linux_plaintext_passwords
+        if export_formats:
+            self.export_formats = export_formats
+
+    def password_key(self, context: str) -> typing.Optional['PasswordKey']:
+        """Return the key to derive passwords for the given context with, or None to generate random passwords"""
+
+        if not self.password_key_file:
+            return None
+        return PasswordKey.load(self.password_key_file, self.password_key_version, context)
 
 
 class CdsConfig(object):
@@ -234,12 +561,7 @@ class ContestConfig(object):
             self.account_types = AccountTypesConfig(**account_types)
 
     def load_contest_config(self, filename: str):
-        contest_yaml = get_yaml_file_contests(filename)
-        if 'start_time' in contest_yaml:
-            start_time_property = 'start_time'
-        else:
-            start_time_property = 'start-time'
-        self.config = ContestObject(name=contest_yaml['name'], start_time=contest_yaml.get(start_time_property))
+        self.config = load_contest_object(filename)
 
     def contest_option_or_global(self, name: str, global_settings: GlobalSettings, default: any = None) -> any:
         if getattr(self, name) is not None:
@@ -251,11 +573,106 @@ class ContestConfig(object):
         return default
 
 
+def load_contest_object(filename: str) -> ContestObject:
+    contest_yaml = get_yaml_file_contests(filename)
+    if 'start_time' in contest_yaml:
+        start_time_property = 'start_time'
+    else:
+        start_time_property = 'start-time'
+    return ContestObject(name=contest_yaml['name'], start_time=contest_yaml.get(start_time_property))
+
+
+class ContestRegistry(collections.abc.Mapping):
+    """Read-only mapping from contest name to its config, for all contests in the contests folder.
+
+    Contests are found by only looking for a `contest.yaml` or `config/contest.yaml` file in every folder. The file of
+    a contest is only parsed when the contest is looked up, so a contests folder with many old contests does not slow
+    down generating a single source. `summaries` returns the name and start time of all contests from an index in the
+    cache folder, which only parses the files that changed since the index was written."""
+
+    contests_folder: str
+    cache_folder: typing.Optional[str]
+    _settings: typing.Dict[str, dict]
+    _files: typing.Optional[typing.Dict[str, typing.Tuple[str, bool]]] = None
+    _contests: typing.Dict[str, ContestConfig]
+
+    def __init__(self, contests_folder: str, settings: typing.Optional[typing.Dict[str, dict]] = None,
+                 cache_folder: typing.Optional[str] = None) -> None:
+        self.contests_folder = contests_folder
+        self.cache_folder = cache_folder
+        self._settings = settings or {}
+        self._contests = {}
+
+    def files(self) -> typing.Dict[str, typing.Tuple[str, bool]]:
+        """Return the contest file per contest and whether it is in the config folder, sorted on contest name"""
+
+        if self._files is None:
+            self._files = {}
+            for folder in sorted(f.name for f in os.scandir(self.contests_folder) if f.is_dir()):
+                new_file = f'{self.contests_folder}/{folder}/contest.yaml'
+                old_file = f'{self.contests_folder}/{folder}/config/contest.yaml'
+                if os.path.isfile(new_file):
+                    self._files[folder] = (new_file, False)
+                elif os.path.isfile(old_file):
+                    self._files[folder] = (old_file, True)
+                # Otherwise no contest.yaml found, skipping
+        return self._files
+
+    def __getitem__(self, name: str) -> ContestConfig:
+        if name not in self._contests:
+            file, uses_config_folder = self.files()[name]
+            contest = ContestConfig(**self._settings.get(name, {}))
+            contest.load_contest_config(file)
+            contest.uses_config_folder = uses_config_folder
+            self._contests[name] = contest
+        return self._contests[name]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.files()
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self.files())
+
+    def __len__(self) -> int:
+        return len(self.files())
+
+    def summaries(self) -> typing.Dict[str, typing.Tuple[str, str]]:
+        """Return the name and start time per contest, using the cached index for contest files that did not change"""
+
+        index_file = f'{self.cache_folder}/contests.json' if self.cache_folder else None
+        index = {}
+        if index_file:
+            try:
+                with open(index_file) as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+        summaries = {}
+        new_index = {}
+        for name, (file, _) in self.files().items():
+            stat = os.stat(file)
+            entry = index.get(name)
+            if not entry or entry['file'] != file or entry['size'] != stat.st_size or \
+                    entry['mtime_ns'] != stat.st_mtime_ns:
+                contest = self._contests[name].config if name in self._contests else load_contest_object(file)
+                entry = {'file': file, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'name': contest.name,
+                         'start_time': None if contest.start_time is None else str(contest.start_time)}
+            new_index[name] = entry
+            summaries[name] = (entry['name'], entry['start_time'])
+
+        if index_file and new_index != index:
+            os.makedirs(self.cache_folder, exist_ok=True)
+            with atomic_write(index_file) as f:
+                json.dump(new_index, f, indent=2)
+        return summaries
+
+
 class Config(object):
     global_config: GlobalSettings
     cds: typing.Optional[CdsConfig] = None
     challenge: typing.Optional[ChallengeConfig] = None
-    contests: typing.Dict[str, ContestConfig] = {}
+    contests: ContestRegistry
 
     def __init__(self, global_settings: dict, cds: typing.Optional[dict] = None,
                  challenge: typing.Optional[dict] = None, contests: typing.Dict[str, dict] = None) -> None:
@@ -267,33 +684,16 @@ class Config(object):
 
         self._validate_global()
 
-        # We know the contest folder exists, now load all contests from it
-        contest_folders = [f.name for f in os.scandir(self.global_config.contests_folder) if f.is_dir()]
-        for contest in contest_folders:
-            new_file = f'{self.global_config.contests_folder}/{contest}/contest.yaml'
-            old_file = f'{self.global_config.contests_folder}/{contest}/config/contest.yaml'
-
-            if contests and contest in contests:
-                c = ContestConfig(**contests[contest])
-            else:
-                c = ContestConfig()
-            if os.path.isfile(new_file):
-                c.load_contest_config(new_file)
-                c.uses_config_folder = False
-            elif os.path.isfile(old_file):
-                c.load_contest_config(old_file)
-                c.uses_config_folder = True
-            else:
-                # No contest.yaml found, skipping
-                continue
+        if contests and not isinstance(contests, dict):
+            print('`contests` config key is not a dictionary')
+            exit(1)
 
-            self.contests[contest] = c
+        # We know the contest folder exists, contests in it are loaded when used
+        self.contests = ContestRegistry(self.global_config.contests_folder, contests,
+                                        self.global_config.cache_folder)
 
-        # Now merge in any specific contest configs
+        # Check the specific contest configs
         if contests:
-            if not isinstance(contests, dict):
-                print('`contests` config key is not a dictionary')
-                exit(1)
             for key, value in contests.items():
                 if key not in self.contests:
                     print(f'Contest {key} not found on disk, but has config')
@@ -312,6 +712,34 @@ class Config(object):
             print(f'Contest folder {self.global_config.contests_folder} does not exist')
             exit(1)
 
+        if self.global_config.pdf_backend not in PDF_BACKENDS:
+            print(f'Unknown PDF backend {self.global_config.pdf_backend}, use one of {", ".join(PDF_BACKENDS)}')
+            exit(1)
+
+        if self.global_config.password_key_file and not os.path.isfile(self.global_config.password_key_file):
+            print(f'Password key file {self.global_config.password_key_file} does not exist')
+            exit(1)
+
+        if self.global_config.spool and self.global_config.spool.group_by and \
+                self.global_config.spool.group_by not in Account.__slots__:
+            print(f'Unknown account field {self.global_config.spool.group_by} to group the print spool by, use one of '
+                  f'{", ".join(Account.__slots__)}')
+            exit(1)
+
+        if self.global_config.linux_password_hash and self.global_config.linux_password_hash not in PASSWORD_HASHES:
+            print(f'Unknown Linux password hash {self.global_config.linux_password_hash}, use one of '
+                  f'{", ".join(PASSWORD_HASHES)}')
+            exit(1)
+
+        for export_format in self.global_config.export_formats:
+            if export_format not in EXPORT_FORMATS:
+                print(f'Unknown export format {export_format}, use one of {", ".join(EXPORT_FORMATS)}')
+                exit(1)
+
+        if self.global_config.deploy_method not in DEPLOY_METHODS:
+            print(f'Unknown deploy method {self.global_config.deploy_method}, use one of {", ".join(DEPLOY_METHODS)}')
+            exit(1)
+
     def validate_contest(self, name: str, contest: typing.Optional[ContestConfig]) -> None:
         if not contest.account_types and not self.global_config.account_types:
             print(f'Account types missing for contest {name}')
@@ -376,17 +804,74 @@ class Config(object):
             exit(1)
 
 
+class PasswordKey(object):
+    """Secret key to derive passwords from, instead of generating random ones.
+
+    The password of an account is derived from the key, the version of the key, the context (the source the account is
+    generated for) and the username, using HMAC-SHA256 as a pseudo random function to pick words from the word list. So
+    every password can be derived again independently, without the earlier generated files. Increase the version to
+    get a fresh set of passwords from the same key."""
+
+    key: bytes
+    version: int
+    context: str
+
+    def __init__(self, key: bytes, version: int = 1, context: str = '') -> None:
+        self.key = key
+        self.version = version
+        self.context = context
+
+    @classmethod
+    def load(cls, file: str, version: int = 1, context: str = '') -> 'PasswordKey':
+        with open(file, 'rb') as key_file:
+            key = key_file.read().strip()
+        if not key:
+            print(f'Password key file {file} is empty')
+            exit(1)
+        return cls(key, version, context)
+
+    def _random_numbers(self, username: str) -> typing.Iterator[int]:
+        """Return an endless stream of 32 bit numbers for the given username"""
+
+        block = 0
+        while True:
+            message = f'{self.version}\0{self.context}\0{username}\0{block}'.encode()
+            digest = hmac.new(self.key, message, hashlib.sha256).digest()
+            for offset in range(0, len(digest), 4):
+                yield int.from_bytes(digest[offset:offset + 4], 'big')
+            block += 1
+
+    def derive(self, username: str, num_words: int, words: typing.Optional[typing.Sequence[str]] = None) -> str:
+        """Derive the password for the given username with the given number of words"""
+
+        if words is None:
+            words = WordPool.get()
+        # Skip numbers that would make some words more likely than others
+        limit = 2 ** 32 - 2 ** 32 % len(words)
+        chosen = []
+        for number in self._random_numbers(username):
+            if number < limit:
+                chosen.append(words[number % len(words)].lower())
+                if len(chosen) == num_words:
+                    return '-'.join(chosen)
+
+
 class Account(object):
+    __slots__ = ('id', 'name', 'password', 'type', 'username', 'team_id', 'ip', 'organization', 'linux', 'server',
+                 'url')
+
     id: str
     name: str
-    password: typing.Optional[str] = None
+    password: typing.Optional[str]
     type: str
     username: str
     team_id: typing.Optional[str]
     ip: typing.Optional[str]
     organization: typing.Optional[str]
-    linux: bool = True
-    words: list[str]
+    linux: bool
+    # Only used for CDS accounts
+    server: typing.Optional[str]
+    url: typing.Optional[str]
 
     def __init__(self, id: str, name: str, type: str, username: str, team_id: typing.Optional[str] = None,
                  ip: typing.Optional[str] = None, password: typing.Optional[str] = None,
@@ -396,20 +881,21 @@ class Account(object):
         self.password = password
         self.type = type
         self.username = username
-        if team_id is not None:
-            self.team_id = team_id
-        if ip is not None:
-            self.ip = ip
-        if linux is not None:
-            self.linux = linux
-
-        current_script_directory = os.path.dirname(os.path.abspath(__file__))
-        with open(f'{current_script_directory}/wordlist', 'r') as wordfile:
-            self.words = wordfile.read().splitlines()
-
-    def generate_password(self, num_words: int) -> None:
-        """Generate a random password using the xkcdpass library with the provider number of words"""
-        self.password = xkcdpass.xkcd_password.generate_xkcdpassword(self.words, delimiter='-', numwords=num_words)
+        self.team_id = team_id
+        self.ip = ip
+        self.organization = None
+        self.linux = linux if linux is not None else True
+        self.server = None
+        self.url = None
+
+    def generate_password(self, num_words: int, password_key: typing.Optional[PasswordKey] = None) -> None:
+        """Generate a random password using the xkcdpass library with the provider number of words.
+
+        When given a password key, the password is derived from that key and the username instead"""
+        if password_key:
+            self.password = password_key.derive(self.username, num_words)
+        else:
+            self.password = xkcd_password.generate_xkcdpassword(WordPool.get(), delimiter='-', numwords=num_words)
 
     def to_yaml_dict(self) -> dict:
         data = {
@@ -420,15 +906,222 @@ class Account(object):
             'username': self.username,
         }
 
-        if hasattr(self, 'team_id'):
+        if self.team_id is not None:
             data['team_id'] = self.team_id
 
-        if hasattr(self, 'ip'):
+        if self.ip is not None:
             data['ip'] = self.ip
 
         return data
 
 
+class AccountStore(collections.abc.MutableMapping):
+    """Accounts by username, with indexes on team ID, IP and organization.
+
+    Iterating over the store or its values returns the accounts in the order they were added. Change the indexed fields
+    of stored accounts using `amend` to keep the indexes up to date. When multiple accounts share a team ID or IP,
+    like a team and its coach, looking it up returns the one added last that is still stored."""
+
+    indexed_fields = ('team_id', 'ip', 'organization')
+
+    _accounts: typing.Dict[str, Account]
+    _by_team_id: typing.Dict[str, typing.Dict[str, None]]
+    _by_ip: typing.Dict[str, typing.Dict[str, None]]
+    _by_organization: typing.Dict[str, typing.Dict[str, None]]
+
+    def __init__(self, accounts: typing.Iterable[Account] = ()) -> None:
+        self._accounts = {}
+        self._by_team_id = {}
+        self._by_ip = {}
+        self._by_organization = {}
+        for account in accounts:
+            self.upsert(account)
+
+    def __getitem__(self, username: str) -> Account:
+        return self._accounts[username]
+
+    def __setitem__(self, username: str, account: Account) -> None:
+        if username != account.username:
+            raise KeyError(f'Account {account.username} can not be stored as {username}')
+        self.upsert(account)
+
+    def __delitem__(self, username: str) -> None:
+        self._unindex(self._accounts.pop(username))
+
+    def __contains__(self, username: object) -> bool:
+        return username in self._accounts
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self._accounts)
+
+    def __len__(self) -> int:
+        return len(self._accounts)
+
+    def _index(self, account: Account) -> None:
+        if account.team_id is not None:
+            self._by_team_id.setdefault(str(account.team_id), {})[account.username] = None
+        if account.ip is not None:
+            self._by_ip.setdefault(account.ip, {})[account.username] = None
+        if account.organization is not None:
+            self._by_organization.setdefault(account.organization, {})[account.username] = None
+
+    def _unindex(self, account: Account) -> None:
+        if account.team_id is not None:
+            self._by_team_id.get(str(account.team_id), {}).pop(account.username, None)
+        if account.ip is not None:
+            self._by_ip.get(account.ip, {}).pop(account.username, None)
+        if account.organization is not None:
+            self._by_organization.get(account.organization, {}).pop(account.username, None)
+
+    def upsert(self, account: Account) -> None:
+        """Add the given account, replacing any account with the same username"""
+
+        if account.username in self._accounts:
+            self._unindex(self._accounts[account.username])
+        self._accounts[account.username] = account
+        self._index(account)
+
+    def amend(self, username: str, **changes: typing.Any) -> Account:
+        """Change the given fields of the account with the given username"""
+
+        account = self._accounts[username]
+        self._unindex(account)
+        for field, value in changes.items():
+            setattr(account, field, value)
+        self._index(account)
+        return account
+
+    def merge(self, other: typing.Mapping[str, Account]) -> None:
+        """Add all accounts of the other store, replacing existing accounts with the same username"""
+
+        for account in other.values():
+            self.upsert(account)
+
+    def _last(self, usernames: typing.Optional[typing.Dict[str, None]]) -> typing.Optional[Account]:
+        return self._accounts[next(reversed(usernames))] if usernames else None
+
+    def by_team_id(self, team_id: str) -> typing.Optional[Account]:
+        return self._last(self._by_team_id.get(str(team_id)))
+
+    def by_ip(self, ip: str) -> typing.Optional[Account]:
+        return self._last(self._by_ip.get(ip))
+
+    def by_organization(self, organization: str) -> typing.List[Account]:
+        return [self._accounts[username] for username in self._by_organization.get(organization, {})]
+
+    def organizations(self) -> typing.List[str]:
+        return [organization for organization, usernames in self._by_organization.items() if usernames]
+
+
+class AccountFilter(object):
+    """Selects accounts by username glob, team ID range, organization, type, IP subnet or any other account field.
+
+    Every condition is a field with one or more values, of which at least one must match. All conditions must match.
+    Values are globs, except for team ID ranges like `10-20` and IP addresses or subnets like `10.0.0.0/24`. Conditions
+    on exact usernames and organizations use the indexes of the account store, so only the matching accounts are looked
+    at."""
+
+    conditions: typing.List[typing.Tuple[str, typing.List[str]]]
+
+    def __init__(self, conditions: typing.List[typing.Tuple[str, typing.List[str]]]) -> None:
+        self.conditions = conditions
+
+    @staticmethod
+    def parse(only: typing.Sequence[str] = (), where: typing.Sequence[str] = ()) -> typing.Optional['AccountFilter']:
+        """Parse the given username globs and `field=value[,value...]` conditions into a filter.
+
+        Returns None when there are no conditions at all"""
+
+        conditions = [('username', pattern.split(',')) for pattern in only]
+        for condition in where:
+            field, separator, value = condition.partition('=')
+            field = field.strip()
+            if not separator or field not in Account.__slots__:
+                print(f'Invalid filter {condition}, use FIELD=VALUE where FIELD is one of '
+                      f'{", ".join(Account.__slots__)}')
+                exit(1)
+            values = [v.strip() for v in value.split(',')]
+            for v in values:
+                if field == 'ip' and not AccountFilter._is_glob(v):
+                    try:
+                        ipaddress.ip_network(v, strict=False)
+                    except ValueError:
+                        print(f'Invalid IP address or subnet {v}')
+                        exit(1)
+            conditions.append((field, values))
+        return AccountFilter(conditions) if conditions else None
+
+    @staticmethod
+    def _is_glob(value: str) -> bool:
+        return any(c in value for c in '*?[')
+
+    @staticmethod
+    def _is_range(field: str, value: str) -> bool:
+        low, separator, high = value.partition('-')
+        return field == 'team_id' and bool(separator) and low.isdigit() and high.isdigit()
+
+    def description(self) -> str:
+        return ' '.join(f'{field}={",".join(values)}' for field, values in self.conditions)
+
+    def has_condition(self, field: str) -> bool:
+        return any(condition_field == field for condition_field, _ in self.conditions)
+
+    def suffix(self) -> str:
+        """Return a suffix for files generated for the filtered accounts only.
+
+        The readable part drops characters that do not belong in file names, so a hash of the full filter is appended to
+        keep filters like `team1` and `team1*` apart"""
+
+        readable = re.sub('[^A-Za-z0-9.=-]+', '_', self.description()).strip('_')[:50]
+        return f'{readable}-{hashlib.sha256(self.description().encode()).hexdigest()[:8]}'
+
+    def _value_matches(self, field: str, pattern: str, value: typing.Any) -> bool:
+        if value is None:
+            return False
+        if self._is_range(field, pattern):
+            low, _, high = pattern.partition('-')
+            return str(value).isdigit() and int(low) <= int(value) <= int(high)
+        if field == 'ip' and not self._is_glob(pattern):
+            try:
+                return ipaddress.ip_address(value) in ipaddress.ip_network(pattern, strict=False)
+            except ValueError:
+                return False
+        return fnmatch.fnmatchcase(str(value), pattern)
+
+    def matches(self, account: Account) -> bool:
+        return all(any(self._value_matches(field, pattern, getattr(account, field)) for pattern in values)
+                   for field, values in self.conditions)
+
+    def _indexed(self, accounts: 'AccountStore', field: str,
+                 values: typing.List[str]) -> typing.Optional[typing.Set[str]]:
+        """Return the usernames of the accounts matching the given condition using an index, if possible"""
+
+        if any(self._is_glob(value) or self._is_range(field, value) for value in values):
+            return None
+        if field == 'username':
+            return {value for value in values if value in accounts}
+        if field == 'organization':
+            return {account.username for value in values for account in accounts.by_organization(value)}
+        # The team ID and IP lookups only return one account per value, while for example coaches share team IDs
+        # with their teams, so those are not used
+        return None
+
+    def select(self, accounts: 'AccountStore') -> 'AccountStore':
+        """Return a store with the matching accounts, in the same order"""
+
+        candidates = None
+        for field, values in self.conditions:
+            usernames = self._indexed(accounts, field, values)
+            if usernames is not None:
+                candidates = usernames if candidates is None else candidates & usernames
+
+        if candidates is None:
+            usernames = accounts.keys()
+        else:
+            usernames = [username for username in accounts if username in candidates]
+        return AccountStore(accounts[username] for username in usernames if self.matches(accounts[username]))
+
+
 class CdsConfigFileServer(object):
     name: str
     url: str
@@ -460,12 +1153,12 @@ class CdsConfigFile(object):
         self.accounts = [CdsConfigFileAccount(**a) for a in accounts]
 
 
-def natural_sort(items: typing.List[dict]) -> typing.List[dict]:
+def natural_sort_key(id: str) -> list:
     convert = lambda text: int(text) if text.isdigit() else text.lower()
-    alphanum_key = lambda key: [convert(c) for c in re.split('([0-9]+)', key['id'])]
-    return sorted(items, key=alphanum_key)
+    return [convert(c) for c in re.split('([0-9]+)', id)]
 
 
+@profiled()
 def load_config() -> Config:
     config_data = get_yaml_file_contests('config.yaml')
     return Config(**config_data)
@@ -499,17 +1192,20 @@ def ask(title: str, choices: typing.Dict[str, str], invalid_message: str) -> str
             print(f'{invalid_message} {choice}', file=sys.stderr)
 
 
+@profiled()
 def load_accounts(file: str, number_of_words_per_password: int, ip_prefix: typing.Optional[str] = None,
                   ip_drop_prefix: typing.Optional[str] = None,
-                  accounts: typing.Optional[typing.Dict[str, Account]] = None,
-                  regenerate_passwords: bool = False) -> typing.Dict[str, Account]:
-    if not os.path.isfile(file):
-        return {}
-
+                  accounts: typing.Optional[AccountStore] = None,
+                  regenerate_passwords: bool = False,
+                  cache_folder: typing.Optional[str] = None,
+                  password_key: typing.Optional[PasswordKey] = None) -> AccountStore:
     if accounts is None:
-        accounts = {}
+        accounts = AccountStore()
+
+    if not os.path.isfile(file):
+        return accounts
 
-    accounts_data = get_yaml_file_contests(file)
+    accounts_data = get_yaml_file_cached(file, cache_folder)
     for account in accounts_data:
         id = account.get('id', account['username'])
         username = account['username']
@@ -525,36 +1221,80 @@ def load_accounts(file: str, number_of_words_per_password: int, ip_prefix: typin
                     ip = f'{ip_prefix}.{int(ip_octet)}'
         if username in accounts:
             if ip:
-                accounts[username].ip = ip
+                accounts.amend(username, ip=ip)
         else:
             account = Account(id, account.get('name', account['username']), account['type'], account['username'], None,
                               ip,
                               account.get('password', None))
             if regenerate_passwords or not account.password:
-                account.generate_password(number_of_words_per_password)
+                account.generate_password(number_of_words_per_password, password_key)
 
-            accounts[account.username] = account
+            accounts.upsert(account)
 
+    profiler.count(accounts=len(accounts))
     return accounts
 
 
-def add_team_accounts(accounts: typing.Dict[str, Account], file: str, number_of_words_per_password: int,
+def _read_teams(file: str) -> typing.List[tuple]:
+    """Read the teams in the given file, sorted naturally on ID and only keeping the fields we need"""
+
+    teams = []
+    for team in iter_json_file(file):
+        teams.append((team['id'], team.get('label', team['id']), team.get('display_name', team['name']),
+                      team.get('organization_id')))
+    teams.sort(key=lambda team: natural_sort_key(team[0]))
+    return teams
+
+
+def _read_organizations(file: str) -> typing.Dict[typing.Any, str]:
+    """Read the organizations in the given file into a dictionary from ID to formal name"""
+
+    return {org['id']: org['formal_name'] for org in iter_json_file(file)}
+
+
+# Parsed JSON files by path and reader, with the size and modification time of the file when it was read
+_json_files: typing.Dict[typing.Tuple[str, str], typing.Tuple[typing.Optional[typing.Tuple[int, int]], typing.Any]] = {}
+
+
+def read_json_file_cached(file: str, reader: typing.Callable[[str], typing.Any]) -> typing.Any:
+    """Return `reader(file)`, reusing the earlier result for the same file and reader as long as the file is unchanged.
+
+    This makes sure files used multiple times, like an organizations file shared by the teams and coaches of the
+    challenge, are only parsed once. Callers should not modify the result, since it is shared."""
+
+    key = (os.path.abspath(file), reader.__name__)
+    state = _file_state(file)
+    if key in _json_files and state is not None and _json_files[key][0] == state:
+        return _json_files[key][1]
+    result = reader(file)
+    _json_files[key] = (state, result)
+    return result
+
+
+def preload_json_files(files: typing.Iterable[typing.Tuple[str, typing.Callable[[str], typing.Any]]]) -> None:
+    """Read the given files with their reader using `read_json_file_cached` in parallel, so later calls are free"""
+
+    files = set(files)
+    if len(files) <= 1:
+        for file, reader in files:
+            read_json_file_cached(file, reader)
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(files), 8)) as executor:
+        # Consume the results, so errors are raised here
+        list(executor.map(lambda file_reader: read_json_file_cached(*file_reader), files))
+
+
+@profiled()
+def add_team_accounts(accounts: AccountStore, file: str, number_of_words_per_password: int,
                       ip_prefix: typing.Optional[str] = None, ip_drop_prefix: typing.Optional[str] = None,
                       username_prefix: str = 'team', name_prefix: typing.Optional[str] = None,
-                      organizations_file: typing.Optional[str] = None, linux: bool = True) -> typing.Dict[str, Account]:
-    team_data: typing.List[dict] = get_json_file_contests(file)
-
+                      organizations_file: typing.Optional[str] = None, linux: bool = True,
+                      password_key: typing.Optional[PasswordKey] = None) -> AccountStore:
     organizations = {}
     if organizations_file is not None:
-        organizations = {org['id']: org for org in get_json_file_contests(organizations_file)}
-
-    team_data = natural_sort(team_data)
+        organizations = read_json_file_cached(organizations_file, _read_organizations)
 
-    for team in team_data:
-        team_id = team['id']
-        team_label = team_id
-        if 'label' in team:
-            team_label = team['label']
+    for team_id, team_label, name, organization_id in read_json_file_cached(file, _read_teams):
         username = f'{username_prefix}{team_label}'
         ip = None
         if ip_prefix:
@@ -564,28 +1304,27 @@ def add_team_accounts(accounts: typing.Dict[str, Account], file: str, number_of_
             if ip_octet.isdigit():
                 ip = f'{ip_prefix}.{int(ip_octet)}'
         if username in accounts:
-            accounts[username].team_id = team_id
-            accounts[username].linux = linux
+            changes = {'team_id': team_id, 'linux': linux}
             if ip is not None:
-                accounts[username].ip = ip
+                changes['ip'] = ip
+            accounts.amend(username, **changes)
         else:
-            name = team.get('display_name', team['name'])
             if name_prefix:
                 name = f'{name_prefix}{name}'
             account = Account(username, name, 'team', username, team_id, ip, None, linux)
-            account.generate_password(number_of_words_per_password)
-            accounts[username] = account
+            account.generate_password(number_of_words_per_password, password_key)
+            accounts.upsert(account)
 
         if organizations_file:
-            if 'organization_id' not in team:
+            if organization_id is None:
                 print(f'Team {team_id} does not have an organization set')
                 exit(1)
-            organization_id = team['organization_id']
             if organization_id not in organizations:
                 print(f'Team {team_id} has unknown organization {organization_id}')
                 exit(1)
-            accounts[username].organization = organizations[organization_id]['formal_name']
+            accounts.amend(username, organization=organizations[organization_id])
 
+    profiler.count(accounts=len(accounts))
     return accounts
 
 
@@ -597,18 +1336,133 @@ def get_yaml_file_contests(file: str):
         exit(1)
 
     with open(file, 'r') as yaml_file:
-        return yaml.safe_load(yaml_file)
+        return yaml.load(yaml_file, Loader=YamlLoader)
+
+
+def get_yaml_file_cached(file: str, cache_folder: typing.Optional[str] = None):
+    """Read the given YAML file and return it's content, reusing the content parsed by an earlier run if possible.
+
+    Parsed content is stored in `cache_folder`, together with the path, size and modification time of the file. When
+    those did not change, the stored content is returned without parsing the file again. The content contains
+    passwords, so it is stored only readable by the current user, and stored content that is owned by someone else or
+    readable by others is not trusted. It is stored with marshal, which unlike pickle can not run code when loading."""
+
+    if not cache_folder or not os.path.isfile(file):
+        return get_yaml_file_contests(file)
+
+    file_stat = os.stat(file)
+    key = (os.path.abspath(file), file_stat.st_size, file_stat.st_mtime_ns)
+    snapshot_folder = f'{cache_folder}/yaml'
+    snapshot_file = f'{snapshot_folder}/{hashlib.sha256(key[0].encode()).hexdigest()}.marshal'
+    try:
+        with open(snapshot_file, 'rb') as snapshot:
+            snapshot_stat = os.fstat(snapshot.fileno())
+            if hasattr(os, 'getuid') and (snapshot_stat.st_uid != os.getuid() or snapshot_stat.st_mode & 0o077):
+                raise ValueError('Snapshot is not private')
+            snapshot_key, content = marshal.load(snapshot)
+        if snapshot_key == key:
+            return content
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    content = get_yaml_file_contests(file)
+    try:
+        data = marshal.dumps((key, content))
+    except ValueError:
+        # Content like dates can not be stored, so just parse those files every time
+        return content
+    os.makedirs(snapshot_folder, exist_ok=True)
+    with atomic_write(snapshot_file, 'wb', permissions=0o600) as snapshot:
+        snapshot.write(data)
+    # Earlier versions stored pickled snapshots
+    with contextlib.suppress(OSError):
+        os.remove(f'{os.path.splitext(snapshot_file)[0]}.pickle')
+    return content
+
+
+def iter_json_file(file: str) -> typing.Iterator[typing.Any]:
+    """Yield the items of the JSON array in the given file.
+
+    Uses orjson to parse the whole file at once when it is installed, since that is a lot faster. Otherwise the file is
+    streamed using `iter_json_array`."""
+
+    if orjson is None:
+        yield from iter_json_array(file)
+        return
+
+    if not os.path.isfile(file):
+        print(f'File {file} not found')
+        exit(1)
+    with open(file, 'rb') as json_file:
+        data = orjson.loads(json_file.read())
+    if not isinstance(data, list):
+        print(f'File {file} does not contain a JSON list')
+        exit(1)
+    yield from data
 
 
-def get_json_file_contests(file: str):
-    """Read the given JSON file and return it's content"""
+def iter_json_array(file: str, chunk_size: int = 64 * 1024) -> typing.Iterator[typing.Any]:
+    """Yield the items of the JSON array in the given file one by one, without reading the whole file in memory.
+
+    Only the text of the file is not kept in memory at once. Callers like `_read_teams` still collect all items, but
+    never need the whole text and all parsed items at the same time."""
 
     if not os.path.isfile(file):
         print(f'File {file} not found')
         exit(1)
 
+    decoder = json.JSONDecoder()
     with open(file, 'r') as json_file:
-        return json.load(json_file)
+        buffer = ''
+        position = 0
+        end_of_file = False
+
+        def read_more() -> bool:
+            nonlocal buffer, position, end_of_file
+            data = json_file.read(chunk_size)
+            end_of_file = not data
+            buffer = buffer[position:] + data
+            position = 0
+            return not end_of_file
+
+        def skip_whitespace() -> typing.Optional[str]:
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position].isspace():
+                    position += 1
+                if position < len(buffer):
+                    return buffer[position]
+                if not read_more():
+                    return None
+
+        if skip_whitespace() != '[':
+            print(f'File {file} does not contain a JSON list')
+            exit(1)
+        position += 1
+
+        while True:
+            character = skip_whitespace()
+            if character is None:
+                print(f'File {file} ends in the middle of a JSON list')
+                exit(1)
+            if character == ']':
+                return
+            if character == ',':
+                position += 1
+                continue
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if read_more():
+                    continue
+                raise
+            if isinstance(item, (int, float)) and not isinstance(item, bool) and not end_of_file and \
+                    (end == len(buffer) or buffer[end] in '0123456789.eE+-'):
+                # The number might continue in the next part of the file, like `-1` in `-1.5e10`. Decode it again
+                read_more()
+                continue
+            position = end
+            yield item
 
 
 def load_cds_config_file(file: str) -> CdsConfigFile:
@@ -622,30 +1476,1266 @@ def today_formatted() -> str:
     return datetime.date.today().strftime('%A %d %B %Y')
 
 
+@contextlib.contextmanager
+def atomic_write(file: str, mode: str = 'w', permissions: typing.Optional[int] = None,
+                 **kwargs: typing.Any) -> typing.Iterator[typing.IO]:
+    """Open a temporary file next to the given file for writing and move it in place when done.
+
+    Readers of the file, like a CCS polling `accounts.yaml`, never see a missing or half written file. This also means
+    every write creates a new file, so hardlinks to the old version keep the old content. The given permissions are set
+    before anything is written, so the file is never readable by others if the permissions do not allow that. Without
+    permissions, an existing file keeps its permissions, so for example a file someone made private stays private."""
+
+    temporary_file = f'{file}.{os.getpid()}.tmp'
+    try:
+        with _open_temporary(file, temporary_file, mode, permissions, **kwargs) as f:
+            yield f
+        os.replace(temporary_file, file)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temporary_file)
+        raise
+
+
+def _open_temporary(file: str, temporary_file: str, mode: str, permissions: typing.Optional[int],
+                    **kwargs: typing.Any) -> typing.IO:
+    f = open(temporary_file, mode, **kwargs)
+    try:
+        if permissions is None:
+            with contextlib.suppress(OSError):
+                permissions = os.stat(file).st_mode & 0o7777
+        if permissions is not None:
+            os.chmod(temporary_file, permissions)
+    except BaseException:
+        f.close()
+        raise
+    return f
+
+
+@contextlib.contextmanager
+def atomic_write_all(files: typing.Sequence[str], mode: str = 'w',
+                     **kwargs: typing.Any) -> typing.Iterator[typing.List[typing.IO]]:
+    """Open temporary files for all given files like `atomic_write`, and move them in place when all are done.
+
+    When writing any of the files fails, none of them is replaced. Only when all files are written and closed, they are
+    moved in place one after the other."""
+
+    temporary_files = [f'{file}.{os.getpid()}.tmp' for file in files]
+    try:
+        with contextlib.ExitStack() as stack:
+            yield [stack.enter_context(_open_temporary(file, temporary_file, mode, None, **kwargs))
+                   for file, temporary_file in zip(files, temporary_files)]
+        for file, temporary_file in zip(files, temporary_files):
+            os.replace(temporary_file, file)
+    except BaseException:
+        for temporary_file in temporary_files:
+            with contextlib.suppress(OSError):
+                os.remove(temporary_file)
+        raise
+
+
+# Methods to deploy files with, in the order to try them. Every method falls back to copying the file
+DEPLOY_METHODS = {
+    'auto': ['reflink', 'hardlink', 'copy'],
+    'reflink': ['reflink', 'copy'],
+    'hardlink': ['hardlink', 'copy'],
+    'symlink': ['symlink', 'copy'],
+    'copy': ['copy'],
+}
+
+# ioctl to share the data of a file with another file on copy-on-write file systems like Btrfs and XFS
+FICLONE = 0x40049409
+
+
+def _reflink(source: str, target: str) -> None:
+    if fcntl is None:
+        raise OSError('Reflinks are not supported on this platform')
+    with open(source, 'rb') as source_file, open(target, 'wb') as target_file:
+        fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+    shutil.copymode(source, target)
+
+
+def deploy_file(source: str, target: str, method: str = 'auto') -> str:
+    """Publish the source file at the target path, returning the method that was used.
+
+    Depending on the method, the target becomes a reflink, hardlink or symlink to the source, so its data does not need
+    to be copied. If the file system does not allow that, the file is copied. In all cases the new target is created
+    next to the old one and moved in place, so the target is never missing or incomplete. A target that already has the
+    content of the source is left alone."""
+
+    if os.path.exists(target) and os.path.islink(target) == (method == 'symlink') and \
+            (os.path.samefile(source, target) or (method != 'symlink' and filecmp.cmp(source, target, shallow=False))):
+        return 'unchanged'
+
+    temporary_file = f'{target}.{os.getpid()}.tmp'
+    methods = DEPLOY_METHODS[method]
+    for index, deploy_method in enumerate(methods):
+        try:
+            if os.path.lexists(temporary_file):
+                os.remove(temporary_file)
+            if deploy_method == 'reflink':
+                _reflink(source, temporary_file)
+            elif deploy_method == 'hardlink':
+                os.link(source, temporary_file)
+            elif deploy_method == 'symlink':
+                os.symlink(os.path.relpath(os.path.abspath(source), os.path.dirname(os.path.abspath(target))),
+                           temporary_file)
+            else:
+                shutil.copy(source, temporary_file)
+            os.replace(temporary_file, target)
+            return deploy_method
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.remove(temporary_file)
+            if index == len(methods) - 1:
+                raise
+
+
+def deploy_files(files: typing.Sequence[typing.Tuple[str, str]], method: str = 'auto') -> typing.List[str]:
+    """Deploy all given (source, target) pairs concurrently, returning the method used per pair"""
+
+    if len(files) <= 1:
+        return [deploy_file(source, target, method) for source, target in files]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(files), 16)) as executor:
+        return list(executor.map(lambda file: deploy_file(file[0], file[1], method), files))
+
+
 def write_yaml_file(file: str, content: typing.Union[dict, list]) -> None:
     """Write the given content as YAML to the provided file"""
 
-    with open(file, 'w') as yaml_file:
-        yaml.dump(content, yaml_file, sort_keys=False)
+    with atomic_write(file) as yaml_file:
+        yaml.dump(content, yaml_file, Dumper=YamlDumper, sort_keys=False)
+
+
+def iter_chunked(items: typing.Iterable, per_chunk: int) -> typing.Iterator[list]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == per_chunk:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_yaml_records(file: str, records: typing.Iterable[dict], per_chunk: int = 500) -> None:
+    """Write the given records as a YAML list to the provided file while they are produced.
+
+    This writes exactly the same as `write_yaml_file` with a list, but only keeps a chunk of records in memory."""
+
+    with atomic_write(file) as yaml_file:
+        written = False
+        for chunk in iter_chunked(records, per_chunk):
+            yaml.dump(chunk, yaml_file, Dumper=YamlDumper, sort_keys=False)
+            written = True
+        if not written:
+            yaml.dump([], yaml_file, Dumper=YamlDumper)
+
+
+def file_digest(file: str) -> str:
+    """Return the SHA-256 hex digest of the contents of the given file"""
+
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BuildManifest(object):
+    """Remembers from which inputs every generated file of a source was built, so unchanged files can be skipped.
+
+    For every output the manifest stores a key, which is a hash over the contents of the files and the values the output
+    depends on, and the size and modification time the output had after writing it. An output is current when its key
+    did not change and nobody touched it since. The input files of every output are stored as well, so watch mode
+    knows which files to look at. The manifest is stored as JSON in the cache folder; without a cache folder every
+    output is always rebuilt."""
+
+    file: typing.Optional[str]
+    outputs: typing.Dict[str, dict]
+    inputs: typing.Dict[str, typing.List[str]]
+
+    def __init__(self, cache_folder: typing.Optional[str], source: str) -> None:
+        self.file = None
+        self.outputs = {}
+        self.inputs = {}
+        if cache_folder:
+            self.file = f'{cache_folder}/manifests/{re.sub("[^A-Za-z0-9_.-]", "_", source)}.json'
+            try:
+                with open(self.file) as manifest_file:
+                    self.outputs = json.load(manifest_file)
+            except (OSError, ValueError):
+                # No manifest yet, or a broken one, so everything will be rebuilt
+                pass
+
+    def key(self, files: typing.Iterable[typing.Optional[str]], values: typing.Iterable[typing.Any] = ()) -> str:
+        """Return a key for the contents of the given files, which might not exist, and the given values.
+
+        Values can be other keys, in which case the input files of those keys are inputs of this key as well."""
+
+        digest = hashlib.sha256()
+        inputs = []
+        for file in files:
+            digest.update(f'{file}\0{file_digest(file) if file and os.path.isfile(file) else "-"}\0'.encode())
+            if file:
+                inputs.append(file)
+        for value in values:
+            digest.update(f'{value}\0'.encode())
+            inputs += self.inputs.get(value, [])
+        key = digest.hexdigest()
+        self.inputs[key] = sorted(set(inputs))
+        return key
+
+    def is_current(self, output: str, key: str) -> bool:
+        entry = self.outputs.get(output)
+        if not self.file or not entry or entry['key'] != key or not os.path.isfile(output):
+            return False
+        stat = os.stat(output)
+        return entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+
+    def plan(self, source: str, outputs: typing.Dict[str, str], overwrite: bool, dry_run: bool) -> typing.Set[str]:
+        """Return the outputs that need to be rebuilt, given the current key per output.
+
+        Reports what would be rebuilt when doing a dry run and returns nothing in that case, so nothing is written."""
+
+        stale = {output for output, key in outputs.items() if overwrite or not self.is_current(output, key)}
+        if not stale:
+            print(f'All files for {source} are up to date')
+        elif dry_run:
+            print(f'Would rebuild for {source}:')
+            for output in outputs:
+                if output in stale:
+                    print(f'- {output}')
+            return set()
+        return stale
+
+    def record(self, outputs: typing.Dict[str, str]) -> None:
+        """Record the given outputs with their key and save the manifest"""
+
+        if not self.file:
+            return
+        for output, key in outputs.items():
+            if os.path.isfile(output):
+                stat = os.stat(output)
+                self.outputs[output] = {'key': key, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                        'inputs': self.inputs.get(key, [])}
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        with atomic_write(self.file) as manifest_file:
+            json.dump(self.outputs, manifest_file, indent=2)
+
+    def input_files(self) -> typing.Set[str]:
+        """Return the input files of all recorded outputs"""
+
+        return {file for entry in self.outputs.values() for file in entry.get('inputs', [])}
+
+
+def template_path(template_file: str) -> str:
+    """Return the path of the given template in the templates folder"""
+
+    return f'{os.path.dirname(os.path.abspath(__file__))}/templates/{template_file}'
+
+
+_template_environment: typing.Optional['jinja2.Environment'] = None
+
+
+def template_environment() -> 'jinja2.Environment':
+    """Return the Jinja environment for the templates folder, shared by all calls in this process.
+
+    Loaded templates are kept in memory and reloaded when their modification time changes. The compiled code is also
+    stored in a bytecode cache in the user's cache directory, so later runs do not need to compile the templates
+    again. Entries in that cache are only used when the template source did not change."""
+
+    global _template_environment
+    if _template_environment is None:
+        cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        bytecode_folder = f'{cache_home}/icpcpwutils/templates'
+        bytecode_cache = None
+        try:
+            os.makedirs(bytecode_folder, exist_ok=True)
+            bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_folder)
+        except OSError:
+            # Not being able to cache compiled templates only makes us slower
+            pass
+        template_loader = jinja2.FileSystemLoader(searchpath=f'{os.path.dirname(os.path.abspath(__file__))}/templates')
+        _template_environment = jinja2.Environment(loader=template_loader, bytecode_cache=bytecode_cache,
+                                                   auto_reload=True)
+    return _template_environment
+
+
+def load_template(template_file: str) -> 'jinja2.Template':
+    """Load the given template from the templates folder"""
+
+    return template_environment().get_template(template_file)
+
+
+@profiled()
+def render_template(template_file: str, sheet_variables: dict) -> str:
+    """Render the given content using the given template to HTML, without converting it to PDF"""
+
+    return load_template(template_file).render(sheet_variables)
+
+
+@profiled()
+def write_template(template_file: str, sheet_variables: dict, output_file: str, buffer_size: int = 1 << 20) -> None:
+    """Render the given content using the given template to the given HTML file.
+
+    The template output is streamed to the file in buffered chunks, so the full document never exists in memory"""
+
+    with open(output_file, 'w', encoding='utf-8', buffering=buffer_size) as html_file:
+        html_file.writelines(load_template(template_file).generate(sheet_variables))
+
+
+class PdfBackend(object):
+    """Interface for converting a template and its variables to a PDF file"""
+
+    def supports(self, template_file: str, sheet_variables: dict, page_size: str) -> bool:
+        """Whether this backend is able to render the given template and variables"""
+
+        return True
+
+    def render(self, template_file: str, sheet_variables: dict, output_file: str, page_size: str,
+               orientation: str) -> None:
+        raise NotImplementedError
+
+
+class WkhtmltopdfBackend(PdfBackend):
+    """Backend rendering the HTML templates using the external wkhtmltopdf program"""
+
+    def render(self, template_file: str, sheet_variables: dict, output_file: str, page_size: str,
+               orientation: str) -> None:
+        options = {
+            'page-size': page_size,
+            'orientation': orientation,
+            'encoding': "UTF-8",
+            'no-outline': None,
+            'enable-local-file-access': None
+        }
+        # Stream the HTML to a file wkhtmltopdf reads directly, instead of rendering it to a string pdfkit would write
+        # to a temporary file anyway. For large contests that string is hundreds of megabytes
+        with tempfile.TemporaryDirectory() as html_folder:
+            html_file = f'{html_folder}/{os.path.splitext(os.path.basename(template_file))[0]}.html'
+            write_template(template_file, sheet_variables, html_file)
+            pdfkit.from_file(html_file, output_file, options=options)
+
+
+# Widths of the printable ASCII characters (32 up to and including 126) of the standard PDF fonts, in 1/1000 em
+_HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+_HELVETICA_BOLD_WIDTHS = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+
+# Page sizes in points, in portrait orientation
+_PDF_PAGE_SIZES = {
+    'A3': (841.89, 1190.55),
+    'A4': (595.28, 841.89),
+    'A5': (419.53, 595.28),
+    'LEGAL': (612.0, 1008.0),
+    'LETTER': (612.0, 792.0),
+}
+
+
+class _PdfImage(object):
+    """Image that can be embedded in a PDF as is, without decoding it"""
+
+    width: int
+    height: int
+    dictionary: str
+    data: bytes
+
+    def __init__(self, width: int, height: int, dictionary: str, data: bytes) -> None:
+        self.width = width
+        self.height = height
+        self.dictionary = dictionary
+        self.data = data
+
+    @staticmethod
+    def load(file: str) -> typing.Optional['_PdfImage']:
+        """Load the given JPEG or PNG file, or return None if it can not be embedded directly"""
+
+        with open(file, 'rb') as image_file:
+            data = image_file.read()
+        if data.startswith(b'\xff\xd8'):
+            return _PdfImage._load_jpeg(data)
+        if data.startswith(b'\x89PNG\r\n\x1a\n'):
+            return _PdfImage._load_png(data)
+        return None
+
+    @staticmethod
+    def _load_jpeg(data: bytes) -> typing.Optional['_PdfImage']:
+        index = 2
+        while index + 9 < len(data):
+            if data[index] != 0xFF:
+                return None
+            marker = data[index + 1]
+            if marker == 0xFF:
+                index += 1
+                continue
+            if 0xD0 <= marker <= 0xD9 or marker == 0x01:
+                index += 2
+                continue
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height = int.from_bytes(data[index + 5:index + 7], 'big')
+                width = int.from_bytes(data[index + 7:index + 9], 'big')
+                color_spaces = {1: '/DeviceGray', 3: '/DeviceRGB'}
+                if data[index + 9] not in color_spaces:
+                    return None
+                dictionary = (f'/Width {width} /Height {height} /ColorSpace {color_spaces[data[index + 9]]} '
+                              '/BitsPerComponent 8 /Filter /DCTDecode')
+                return _PdfImage(width, height, dictionary, data)
+            index += 2 + int.from_bytes(data[index + 2:index + 4], 'big')
+        return None
+
+    @staticmethod
+    def _load_png(data: bytes) -> typing.Optional['_PdfImage']:
+        index = 8
+        header = None
+        palette = b''
+        image_data = []
+        transparent = False
+        while index + 8 <= len(data):
+            length = int.from_bytes(data[index:index + 4], 'big')
+            chunk_type = data[index + 4:index + 8]
+            chunk = data[index + 8:index + 8 + length]
+            if chunk_type == b'IHDR':
+                header = chunk
+            elif chunk_type == b'PLTE':
+                palette = chunk
+            elif chunk_type == b'IDAT':
+                image_data.append(chunk)
+            elif chunk_type == b'tRNS':
+                transparent = True
+            elif chunk_type == b'IEND':
+                break
+            index += 12 + length
+
+        if header is None:
+            return None
+        width = int.from_bytes(header[0:4], 'big')
+        height = int.from_bytes(header[4:8], 'big')
+        bit_depth, color_type, interlace = header[8], header[9], header[12]
+        # Images with an alpha channel or a transparent color (a tRNS chunk, for example in palette images) need to be
+        # decoded to build a soft mask, leave those to others
+        if bit_depth != 8 or interlace != 0 or color_type not in (0, 2, 3) or transparent:
+            return None
+        if color_type == 0:
+            color_space, colors = '/DeviceGray', 1
+        elif color_type == 2:
+            color_space, colors = '/DeviceRGB', 3
+        else:
+            color_space, colors = f'[/Indexed /DeviceRGB {len(palette) // 3 - 1} <{palette.hex()}>]', 1
+        dictionary = (f'/Width {width} /Height {height} /ColorSpace {color_space} /BitsPerComponent 8 '
+                      f'/Filter /FlateDecode /DecodeParms << /Predictor 15 /Colors {colors} /BitsPerComponent 8 '
+                      f'/Columns {width} >>')
+        return _PdfImage(width, height, dictionary, b''.join(image_data))
+
+
+class _PdfPage(object):
+    """Content of a single PDF page. Positions are in points, measured from the top left of the page"""
+
+    width: float
+    height: float
+    operations: typing.List[bytes]
+
+    fonts = {'F1': 'Helvetica', 'F2': 'Helvetica-Bold', 'F3': 'Courier'}
+
+    def __init__(self, width: float, height: float) -> None:
+        self.width = width
+        self.height = height
+        self.operations = []
+
+    @staticmethod
+    def text_width(text: str, font: str, size: float) -> float:
+        if font == 'F3':
+            return len(text) * 0.6 * size
+        widths = _HELVETICA_BOLD_WIDTHS if font == 'F2' else _HELVETICA_WIDTHS
+        total = 0
+        for character in text:
+            code = ord(character)
+            total += widths[code - 32] if 32 <= code <= 126 else 556
+        return total * size / 1000
+
+    @staticmethod
+    def fit_size(text: str, font: str, size: float, max_width: float) -> float:
+        """Return the given font size, or a smaller one if needed to make the text fit in the given width"""
+
+        width = _PdfPage.text_width(text, font, size)
+        if width > max_width > 0:
+            return size * max_width / width
+        return size
+
+    @staticmethod
+    def wrap(text: str, font: str, size: float, max_width: float) -> typing.List[str]:
+        lines = []
+        line = ''
+        for word in text.split(' '):
+            candidate = f'{line} {word}' if line else word
+            if line and _PdfPage.text_width(candidate, font, size) > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+        return lines
+
+    def text(self, x: float, baseline: float, text: typing.Any, font: str = 'F1', size: float = 12,
+             align: str = 'left', gray: float = 0) -> None:
+        text = str(text)
+        if align == 'center':
+            x -= self.text_width(text, font, size) / 2
+        elif align == 'right':
+            x -= self.text_width(text, font, size)
+        escaped = bytearray()
+        for byte in text.encode('cp1252'):
+            if byte in b'\\()':
+                escaped += b'\\' + bytes([byte])
+            elif byte < 32 or byte > 126:
+                escaped += b'\\%03o' % byte
+            else:
+                escaped.append(byte)
+        self.operations.append(b'BT %.3f g /%s %.2f Tf 1 0 0 1 %.2f %.2f Tm (%s) Tj ET' % (
+            gray, font.encode(), size, x, self.height - baseline, bytes(escaped)))
+
+    def image(self, name: str, x: float, top: float, width: float, height: float) -> None:
+        self.operations.append(b'q %.2f 0 0 %.2f %.2f %.2f cm /%s Do Q' % (
+            width, height, x, self.height - top - height, name.encode()))
+
+    def line(self, x1: float, y1: float, x2: float, y2: float) -> None:
+        self.operations.append(b'0.5 w %.2f %.2f m %.2f %.2f l S' % (
+            x1, self.height - y1, x2, self.height - y2))
+
+    def content(self) -> bytes:
+        return b'\n'.join(self.operations)
+
+
+class _PdfDocument(object):
+    """Minimal PDF writer for pages with text in the standard fonts and embedded images"""
+
+    width: float
+    height: float
+
+    def __init__(self, width: float, height: float) -> None:
+        self.width = width
+        self.height = height
+        self._objects: typing.List[typing.Optional[bytes]] = [None]
+        self._pages: typing.List[int] = []
+        self._images: typing.Dict[str, int] = {}
+        self._fonts = {name: self._add(f'<< /Type /Font /Subtype /Type1 /BaseFont /{font} '
+                                       '/Encoding /WinAnsiEncoding >>'.encode())
+                       for name, font in _PdfPage.fonts.items()}
+
+    def _add(self, data: bytes) -> int:
+        self._objects.append(data)
+        return len(self._objects) - 1
+
+    def _stream(self, dictionary: str, data: bytes) -> bytes:
+        return f'<< {dictionary} /Length {len(data)} >>\nstream\n'.encode() + data + b'\nendstream'
+
+    def add_image(self, name: str, image: _PdfImage) -> None:
+        self._images[name] = self._add(self._stream(f'/Type /XObject /Subtype /Image {image.dictionary}', image.data))
+
+    def new_page(self) -> _PdfPage:
+        return _PdfPage(self.width, self.height)
+
+    def add_page(self, page: _PdfPage) -> None:
+        content = self._add(self._stream('/Filter /FlateDecode', zlib.compress(page.content())))
+        fonts = ' '.join(f'/{name} {object_id} 0 R' for name, object_id in self._fonts.items())
+        images = ' '.join(f'/{name} {object_id} 0 R' for name, object_id in self._images.items())
+        self._pages.append(self._add(
+            f'<< /Type /Page /Parent 0 0 R /MediaBox [0 0 {self.width:.2f} {self.height:.2f}] '
+            f'/Resources << /Font << {fonts} >> /XObject << {images} >> >> /Contents {content} 0 R >>'.encode()))
+
+    def write(self, output_file: str) -> None:
+        pages = self._add(f'<< /Type /Pages /Kids [{" ".join(f"{p} 0 R" for p in self._pages)}] '
+                          f'/Count {len(self._pages)} >>'.encode())
+        for page in self._pages:
+            self._objects[page] = self._objects[page].replace(b'/Parent 0 0 R', b'/Parent %d 0 R' % pages, 1)
+        catalog = self._add(f'<< /Type /Catalog /Pages {pages} 0 R >>'.encode())
+
+        output = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for object_id, data in enumerate(self._objects[1:], 1):
+            offsets.append(len(output))
+            output += b'%d 0 obj\n' % object_id + data + b'\nendobj\n'
+        xref = len(output)
+        output += b'xref\n0 %d\n0000000000 65535 f \n' % len(self._objects)
+        for offset in offsets:
+            output += b'%010d 00000 n \n' % offset
+        output += b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+            len(self._objects), catalog, xref)
+
+        with open(output_file, 'wb') as pdf_file:
+            pdf_file.write(output)
+
+
+class NativePdfBackend(PdfBackend):
+    """Backend writing the layouts of the built-in templates directly as PDF, without any external program.
+
+    Only the standard PDF fonts are used, so all text must be representable in the Windows-1252 encoding. Banners must
+    be JPEG files or PNG files without transparency. Templates that differ from the ones shipped with this script are
+    not what the layouts draw. Anything else is left to another backend."""
+
+    # SHA-256 digests of the shipped templates that the layouts reproduce. Update them together with the layouts
+    shipped_templates = {
+        'ccs-and-challenge-sheets.html': '5123cb641ea14214061e1e9a157df172e8c9230918ee9daf4fa0f483e2308838',
+        'ccs-and-challenge-master.html': '69d2a5049c0024ae88af3923e497d78e99cbf93f2c34c268f482bc75a72c3425',
+        'cds-sheets.html': '5d2d3ee9bd59ea726329f272c6f98e38c5492266659244c71b25d28d9a9da876',
+        'cds-master.html': 'e461a6e97e6f30bff43f638dd6f0dd340c390c842c8c1cb488e06047ab6845f2',
+    }
+
+    layouts: typing.Dict[str, typing.Callable]
+    _images: typing.Dict[str, typing.Optional[_PdfImage]]
+    # Per template, whether it is the shipped one, together with the size and modification time that was checked
+    _unmodified: typing.Dict[str, typing.Tuple[typing.Tuple[int, int], bool]]
+
+    def __init__(self) -> None:
+        self.layouts = {
+            'ccs-and-challenge-sheets.html': self._password_sheets,
+            'ccs-and-challenge-master.html': self._master,
+            'cds-sheets.html': self._cds_password_sheets,
+            'cds-master.html': self._cds_master,
+        }
+        self._images = {}
+        self._unmodified = {}
+
+    def _is_unmodified(self, template_file: str) -> bool:
+        """Return whether the given template is still the one shipped with this script"""
+
+        path = template_path(template_file)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        state = (stat.st_size, stat.st_mtime_ns)
+        if self._unmodified.get(template_file, (None,))[0] != state:
+            unmodified = file_digest(path) == self.shipped_templates.get(template_file)
+            if not unmodified:
+                print(f'Template {template_file} was modified, rendering it with wkhtmltopdf', file=sys.stderr)
+            self._unmodified[template_file] = (state, unmodified)
+        return self._unmodified[template_file][1]
+
+    def _image(self, file: str) -> typing.Optional[_PdfImage]:
+        if file not in self._images:
+            self._images[file] = _PdfImage.load(file) if os.path.isfile(file) else None
+        return self._images[file]
+
+    def supports(self, template_file: str, sheet_variables: dict, page_size: str) -> bool:
+        if template_file not in self.layouts or page_size.upper() not in _PDF_PAGE_SIZES or \
+                not self._is_unmodified(template_file):
+            return False
+        banner = sheet_variables.get('banner')
+        if banner and os.path.isfile(banner) and self._image(banner) is None:
+            return False
+
+        texts = [sheet_variables.get(key) for key in ('title', 'footer', 'ccs', 'link', 'date')]
+        accounts = list(sheet_variables.get('accounts', []))
+        for page in sheet_variables.get('pages', []):
+            for item in page:
+                accounts.extend(item if isinstance(item, list) else [item])
+        for account in accounts:
+            texts.extend(getattr(account, attribute, None)
+                         for attribute in ('name', 'username', 'password', 'organization', 'server', 'url', 'type'))
+        try:
+            for text in texts:
+                if text is not None:
+                    str(text).encode('cp1252')
+        except UnicodeEncodeError:
+            return False
+        return True
+
+    def render(self, template_file: str, sheet_variables: dict, output_file: str, page_size: str,
+               orientation: str) -> None:
+        width, height = _PDF_PAGE_SIZES[page_size.upper()]
+        if orientation.lower() == 'landscape':
+            width, height = height, width
+        document = _PdfDocument(width, height)
+        if sheet_variables.get('banner') and self._image(sheet_variables['banner']):
+            document.add_image('Banner', self._image(sheet_variables['banner']))
+        self.layouts[template_file](document, sheet_variables)
+        document.write(output_file)
+
+    @staticmethod
+    def _banner(document: _PdfDocument, page: _PdfPage, image: _PdfImage, margin: float, top: float) -> float:
+        """Draw the banner at the full content width and return the position below it"""
+
+        width = document.width - 2 * margin
+        height = width * image.height / image.width
+        if height > document.height / 4:
+            height = document.height / 4
+            width = height * image.width / image.height
+        page.image('Banner', (document.width - width) / 2, top, width, height)
+        return top + height
+
+    def _password_sheets(self, document: _PdfDocument, sheet_variables: dict) -> None:
+        margin = 42.5
+        content_width = document.width - 2 * margin
+        center = document.width / 2
+        ccs, linux, link = sheet_variables.get('ccs'), sheet_variables.get('linux'), sheet_variables.get('link')
+        banner = self._image(sheet_variables['banner']) if sheet_variables.get('banner') else None
+
+        for account in sheet_variables['accounts']:
+            page = document.new_page()
+            y = 36
+            if banner:
+                y = self._banner(document, page, banner, margin, y) + 12
+
+            title = sheet_variables.get('title') or ''
+            y += 56
+            page.text(center, y, title, 'F1', page.fit_size(title, 'F1', 34, content_width), 'center')
+            y += 32
+            page.text(center, y, 'Account/Password Information', 'F1', 20, 'center')
+            y += 76
+            page.text(center, y, account.name, 'F1', page.fit_size(account.name, 'F1', 32, content_width), 'center',
+                      0.2)
+            organization = getattr(account, 'organization', None)
+            if organization:
+                y += 52
+                page.text(center, y, organization, 'F2', page.fit_size(organization, 'F2', 30, content_width),
+                          'center')
+            y += 44
+
+            account_linux = getattr(account, 'linux', False)
+            if ccs or linux:
+                y += 30
+                if ccs and linux and account_linux:
+                    heading = f'{ccs} / Linux credentials'
+                elif ccs:
+                    heading = f'{ccs} credentials'
+                elif linux and account_linux:
+                    heading = 'Linux credentials'
+                else:
+                    heading = ''
+                page.text(margin + 14, y, heading, 'F2', 23)
+
+            rows = []
+            if link:
+                rows.append(('Link', link, 26))
+            rows.append(('Account name', account.username, 32))
+            rows.append(('Password', account.password, 32))
+            value_x = margin + 14 + page.text_width('Account name', 'F1', 23) + 28
+            for label, value, size in rows:
+                y += 58
+                page.text(margin + 14, y, label, 'F1', 23)
+                page.text(value_x, y, value, 'F3', page.fit_size(value, 'F3', size, document.width - margin - value_x))
+
+            y += 52
+            page.text(margin, y, 'Notes:', 'F1', 16)
+            notes = 'Passwords are CASE SENSITIVE: be sure to type your password EXACTLY as shown above.'
+            for index, line in enumerate(page.wrap(notes, 'F1', 16, content_width - 40)):
+                y += 22
+                if index == 0:
+                    page.text(margin + 22, y, '•', 'F1', 16)
+                page.text(margin + 40, y, line, 'F1', 16)
+
+            if sheet_variables.get('footer'):
+                page.text(center, document.height - 36, sheet_variables['footer'], 'F1', 16, 'center')
+            document.add_page(page)
+
+    @staticmethod
+    def _page_footer(document: _PdfDocument, page: _PdfPage, sheet_variables: dict, margin: float,
+                     page_number: int, number_of_pages: int) -> None:
+        baseline = document.height - 30
+        page.text(margin, baseline, sheet_variables.get('date') or '', 'F1', 11)
+        page.text(document.width / 2, baseline, sheet_variables.get('footer') or '', 'F1', 11, 'center')
+        page.text(document.width - margin, baseline, f'Page {page_number} of {number_of_pages}', 'F1', 11, 'right')
+
+    def _master(self, document: _PdfDocument, sheet_variables: dict) -> None:
+        margin = 30
+        center = document.width / 2
+        pages = sheet_variables['pages']
+        num_columns = sheet_variables['num_columns']
+        ccs, linux = sheet_variables.get('ccs'), sheet_variables.get('linux')
+        if ccs and linux:
+            password_header = f'{ccs} / Linux password'
+        elif ccs:
+            password_header = f'{ccs} password'
+        elif linux:
+            password_header = 'Linux password'
+        else:
+            password_header = 'Password'
+        column_width = (document.width - 2 * margin) / num_columns
+        username_width = column_width * 0.25
+
+        for index, columns in enumerate(pages):
+            page = document.new_page()
+            page.text(center, 52, sheet_variables.get('title') or '', 'F2', 22, 'center')
+            page.text(center, 68, 'Master Password List', 'F1', 11, 'center')
+
+            rows = len(columns[0]) if columns else 0
+            row_height = min(13.0, (document.height - 90 - 50) / (rows + 1))
+            y = 90
+            for column in range(num_columns):
+                x = margin + column * column_width
+                page.text(x + username_width, y, 'Username', 'F2', 10, 'right')
+                page.text(x + username_width + 10, y, password_header, 'F2',
+                          page.fit_size(password_header, 'F2', 10, column_width - username_width - 20))
+            page.line(margin, y + 4, document.width - margin, y + 4)
+            font_size = min(9.0, row_height * 0.8)
+            for row in range(rows):
+                y += row_height
+                for column in range(num_columns):
+                    if column < len(columns) and row < len(columns[column]):
+                        account = columns[column][row]
+                        x = margin + column * column_width
+                        page.text(x + username_width, y, account.username, 'F3',
+                                  page.fit_size(account.username, 'F3', font_size, username_width), 'right')
+                        page.text(x + username_width + 10, y, account.password, 'F3',
+                                  page.fit_size(account.password, 'F3', font_size,
+                                                column_width - username_width - 20))
+
+            self._page_footer(document, page, sheet_variables, margin,
+                              (sheet_variables.get('page_offset') or 0) + index + 1,
+                              sheet_variables.get('total_pages') or len(pages))
+            document.add_page(page)
+
+    def _cds_password_sheets(self, document: _PdfDocument, sheet_variables: dict) -> None:
+        margin = 36
+        center = document.width / 2
+        banner = self._image(sheet_variables['banner']) if sheet_variables.get('banner') else None
+
+        for account in sheet_variables['accounts']:
+            page = document.new_page()
+            y = 36
+            if banner:
+                y = self._banner(document, page, banner, margin, y) + 12
+            y += 48
+            page.text(center, y, 'CDS', 'F2', 34, 'center')
+            y += 36
+            page.text(center, y, 'Account/Password Information', 'F2', 20, 'center')
+            y += 48
+            page.text(center, y, account.name, 'F1', page.fit_size(account.name, 'F1', 26, document.width - 2 * margin),
+                      'center')
+            y += 16
+            for label, value in (('account name:', account.username), ('password:', account.password),
+                                 ('URL:', account.url)):
+                y += 34
+                page.text(center - 10, y, label, 'F1', 17, 'right')
+                page.text(center - 10 - page.text_width(label, 'F1', 17) - 5, y, 'CDS', 'F2', 17, 'right')
+                page.text(center + 10, y, value, 'F3',
+                          page.fit_size(value, 'F3', 17, document.width / 2 - margin - 10))
+
+            page.text(document.width - margin, document.height - 60, account.server, 'F1', 17, 'right')
+            if sheet_variables.get('footer'):
+                page.text(center, document.height - 36, sheet_variables['footer'], 'F1', 17, 'center')
+            document.add_page(page)
+
+    def _cds_master(self, document: _PdfDocument, sheet_variables: dict) -> None:
+        margin = 30
+        pages = sheet_variables['pages']
+        columns = (('CDS server', 'server', 'F1', 0.1), ('username', 'username', 'F3', 0.14),
+                   ('type', 'type', 'F1', 0.1), ('password', 'password', 'F3', 0.24), ('name', 'name', 'F1', 0.2),
+                   ('url', 'url', 'F1', 0.22))
+        table_width = document.width - 2 * margin
+
+        for index, accounts in enumerate(pages):
+            page = document.new_page()
+            page.text(document.width / 2, 52, 'CDS Master Password / URL List', 'F2', 22, 'center')
+            row_height = min(14.0, (document.height - 84 - 50) / (len(accounts) + 1))
+            y = 84
+            x = margin
+            for header, _, _, fraction in columns:
+                page.text(x, y, header, 'F2', 10)
+                x += table_width * fraction
+            page.line(margin, y + 4, document.width - margin, y + 4)
+            for account in accounts:
+                y += row_height
+                x = margin
+                for _, attribute, font, fraction in columns:
+                    value = str(getattr(account, attribute))
+                    page.text(x, y, value, font, page.fit_size(value, font, 9, table_width * fraction - 6))
+                    x += table_width * fraction
+
+            self._page_footer(document, page, sheet_variables, margin,
+                              (sheet_variables.get('page_offset') or 0) + index + 1,
+                              sheet_variables.get('total_pages') or len(pages))
+            document.add_page(page)
+
+
+PDF_BACKENDS: typing.Dict[str, PdfBackend] = {
+    'native': NativePdfBackend(),
+    'wkhtmltopdf': WkhtmltopdfBackend(),
+}
+
+
+# Resolution to downsample banners to, in pixels per inch when printed at the full page width
+BANNER_DPI = 300
+
+
+@profiled()
+def prepare_banner(banner: typing.Optional[str], page_size: str,
+                   cache_folder: typing.Optional[str]) -> typing.Optional[str]:
+    """Return the given banner downsampled to the resolution needed to print it at the full width of the page.
+
+    wkhtmltopdf decodes and scales the banner again for every page and both backends embed it at full resolution, so a
+    large banner makes rendering slow and the PDFs big. The downsampled banner is stored in the cache folder under a
+    hash of the content of the original, so it is only made once. The original banner is returned when it is small
+    enough already, when there is no cache folder or when Pillow is not installed."""
+
+    extension = os.path.splitext(banner or '')[1].lower()
+    if not banner or not cache_folder or pil_image is None or extension not in ('.jpg', '.jpeg', '.png') or \
+            not os.path.isfile(banner):
+        return banner
+
+    page_width = _PDF_PAGE_SIZES.get(page_size.upper(), _PDF_PAGE_SIZES['A4'])[0]
+    max_width = math.ceil(page_width / 72 * BANNER_DPI)
+    prepared = f'{cache_folder}/banners/{file_digest(banner)}-{max_width}{extension}'
+    if os.path.isfile(prepared):
+        return prepared
+
+    try:
+        with pil_image.open(banner) as image:
+            if image.width <= max_width:
+                return banner
+            if image.mode == 'P':
+                image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+            elif image.mode not in ('L', 'LA', 'RGB', 'RGBA') or (extension != '.png' and image.mode != 'L'):
+                # JPEG can only store grayscale and RGB, and for example CMYK can not be embedded directly in PDFs
+                image = image.convert('RGB')
+            resized = image.resize((max_width, max(round(image.height * max_width / image.width), 1)),
+                                   pil_image.LANCZOS)
+    except (OSError, ValueError) as e:
+        print(f'Can not downsample banner {banner}, using it as is: {e}', file=sys.stderr)
+        return banner
+
+    os.makedirs(os.path.dirname(prepared), exist_ok=True)
+    with atomic_write(prepared, 'wb') as prepared_file:
+        if extension == '.png':
+            resized.save(prepared_file, 'PNG', optimize=True)
+        else:
+            resized.save(prepared_file, 'JPEG', quality=90, optimize=True)
+    return prepared
 
 
+def pdf_backend(name: str, template_file: str, sheet_variables: dict, page_size: str) -> PdfBackend:
+    """Return the backend with the given name, or wkhtmltopdf if the backend does not support the given content"""
+
+    backend = PDF_BACKENDS[name]
+    if not backend.supports(template_file, sheet_variables, page_size):
+        backend = PDF_BACKENDS['wkhtmltopdf']
+    return backend
+
+
+@profiled()
 def generate_template_to_pdf(template_file: str, sheet_variables: dict, output_file: str,
-                             page_size: str, orientation: str = 'Portrait') -> None:
+                             page_size: str, orientation: str = 'Portrait', backend: str = 'native') -> None:
     """Write the given content using the given template to the output file as PDF"""
 
-    template_loader = jinja2.FileSystemLoader(searchpath=f'{os.path.dirname(__file__)}/templates')
-    template_env = jinja2.Environment(loader=template_loader)
-    template = template_env.get_template(template_file)
-    output_html = template.render(sheet_variables)
-
-    options = {
-        'page-size': page_size,
-        'orientation': orientation,
-        'encoding': "UTF-8",
-        'no-outline': None,
-        'enable-local-file-access': None
-    }
-    pdfkit.from_string(output_html, output_file, options=options)
+    renderer = pdf_backend(backend, template_file, sheet_variables, page_size)
+    profiler.count(backend=next(name for name, b in PDF_BACKENDS.items() if b is renderer))
+    renderer.render(template_file, sheet_variables, output_file, page_size, orientation)
+
+
+def _render_shard(shard: tuple) -> str:
+    template_file, sheet_variables, output_file, page_size, orientation, backend = shard
+    generate_template_to_pdf(template_file, sheet_variables, output_file, page_size, orientation, backend)
+    return output_file
+
+
+@profiled()
+def generate_sharded_template_to_pdf(template_file: str, sheet_variables: dict, shard_key: str, output_file: str,
+                                     page_size: str, orientation: str = 'Portrait', workers: int = 1,
+                                     backend: str = 'native') -> None:
+    """Write the given content using the given template to the output file as PDF, using multiple processes.
+
+    The list in `sheet_variables[shard_key]` must contain exactly one item per page. It is split into one chunk per
+    worker, each chunk is rendered by its own PDF converter and the results are concatenated in order. The templates get
+    `page_offset` and `total_pages` so they can keep numbering pages as if they rendered the whole document."""
+
+    items = sheet_variables[shard_key]
+    if workers < 1:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(items))
+    if workers > 1 and pypdf is None:
+        print('Install python3-pypdf to render PDFs in parallel, falling back to a single process', file=sys.stderr)
+        workers = 1
+    profiler.count(pages=len(items), workers=max(workers, 1))
+
+    if workers <= 1:
+        generate_template_to_pdf(template_file, sheet_variables, output_file, page_size, orientation, backend)
+        return
+
+    per_shard = math.ceil(len(items) / workers)
+    with tempfile.TemporaryDirectory() as shard_folder:
+        shards = []
+        for index, start in enumerate(range(0, len(items), per_shard)):
+            shard_variables = dict(sheet_variables)
+            shard_variables[shard_key] = items[start:start + per_shard]
+            shard_variables['page_offset'] = start
+            shard_variables['total_pages'] = len(items)
+            shards.append((template_file, shard_variables, f'{shard_folder}/shard-{index}.pdf', page_size,
+                           orientation, backend))
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            shard_files = list(executor.map(_render_shard, shards))
+
+        merge_pdfs(shard_files, output_file)
+
+
+@contextlib.contextmanager
+def page_cache_lock(cache_folder: str) -> typing.Iterator[None]:
+    """Hold an exclusive lock on the given page cache, so no pages are pruned while another process starts using them"""
+
+    if fcntl is None:
+        yield
+        return
+    with open(f'{cache_folder}/.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_page_references(cache_folder: str, output_file: str, pages: typing.List[str], complete: bool) -> None:
+    output_file = os.path.abspath(output_file)
+    references_file = f'{cache_folder}/references/{hashlib.sha256(output_file.encode()).hexdigest()[:32]}.json'
+    os.makedirs(os.path.dirname(references_file), exist_ok=True)
+    with atomic_write(references_file) as f:
+        json.dump({'output': output_file, 'pages': pages, 'complete': complete}, f)
+
+
+@profiled()
+def prune_page_cache(cache_folder: str) -> int:
+    """Remove the pages from the given page cache that the latest run of no output used and return how many.
+
+    Every output records the pages it was assembled from. Outputs that were written completely but do not exist anymore
+    are forgotten, so their pages are removed as well."""
+
+    if not os.path.isdir(cache_folder):
+        return 0
+    removed = 0
+    with page_cache_lock(cache_folder):
+        used = set()
+        references_folder = f'{cache_folder}/references'
+        for entry in os.scandir(references_folder) if os.path.isdir(references_folder) else []:
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path) as f:
+                    references = json.load(f)
+            except (OSError, ValueError):
+                references = {'complete': True, 'output': ''}
+            if references['complete'] and not os.path.exists(references['output']):
+                os.remove(entry.path)
+                continue
+            used.update(references['pages'])
+
+        for entry in os.scandir(cache_folder):
+            if entry.name.endswith('.pdf') and entry.name not in used:
+                os.remove(entry.path)
+                removed += 1
+    profiler.count(pruned_pages=removed)
+    return removed
+
+
+@profiled()
+def generate_cached_template_to_pdf(template_file: str, sheet_variables: dict, shard_key: str, output_file: str,
+                                    page_size: str, cache_folder: str, orientation: str = 'Portrait',
+                                    workers: int = 1, backend: str = 'native',
+                                    output_name: typing.Optional[str] = None) -> None:
+    """Write the given content using the given template to the output file as PDF, reusing earlier rendered pages.
+
+    Every item in `sheet_variables[shard_key]` must render to exactly one page, independently of its position in the
+    document. Pages rendered with wkhtmltopdf are stored in `cache_folder` under a hash of their own HTML and of the
+    files they refer to, so only pages that are new or changed since an earlier run are converted. The final PDF is
+    spliced together from the cache. The native backend renders pages faster than they can be spliced, so its pages are
+    not cached, and without any wkhtmltopdf page the document is rendered as a whole.
+
+    The pages used are recorded under `output_name`, which defaults to the output file, so `prune_page_cache` can remove
+    the others. Note that the cache contains passwords, so protect it as you would protect the generated files."""
+
+    output_name = output_name or output_file
+    os.makedirs(cache_folder, exist_ok=True)
+    if pdf_backend(backend, template_file, sheet_variables, page_size) is PDF_BACKENDS['native']:
+        generate_sharded_template_to_pdf(template_file, sheet_variables, shard_key, output_file, page_size,
+                                         orientation, workers, backend)
+        _write_page_references(cache_folder, output_name, [], True)
+        return
+
+    items = sheet_variables[shard_key]
+
+    # The HTML only refers to the banner by path, so also include its content in the key
+    files_digest = hashlib.sha256()
+    for key, value in sorted(sheet_variables.items()):
+        if key == 'banner' and value and os.path.isfile(value):
+            files_digest.update(file_digest(value).encode())
+
+    template = load_template(template_file)
+    with tempfile.TemporaryDirectory() as page_folder:
+        page_files = []
+        # Pages to render, per backend that is able to render them
+        missing: typing.Dict[str, typing.List[tuple]] = {}
+        cached: typing.List[tuple] = []
+        for index, item in enumerate(items):
+            page_variables = dict(sheet_variables)
+            page_variables[shard_key] = [item]
+            if pdf_backend(backend, template_file, page_variables, page_size) is PDF_BACKENDS['native']:
+                page_file = f'{page_folder}/{index}.pdf'
+                missing.setdefault('native', []).append((item, page_file))
+            else:
+                page_digest = hashlib.sha256(template.render(page_variables).encode())
+                page_digest.update(f'\0{page_size}\0{orientation}\0wkhtmltopdf\0{files_digest.hexdigest()}'.encode())
+                page_file = f'{cache_folder}/{page_digest.hexdigest()}.pdf'
+                cached.append((item, page_file))
+            page_files.append(page_file)
+
+        cached_pages = [os.path.basename(page_file) for _, page_file in cached]
+        with page_cache_lock(cache_folder):
+            # Record the pages before checking which exist, so they can not be pruned until we are done
+            _write_page_references(cache_folder, output_name, cached_pages, False)
+            for item, page_file in cached:
+                if not os.path.isfile(page_file):
+                    missing.setdefault('wkhtmltopdf', []).append((item, page_file))
+
+        profiler.count(pages=len(items), rendered_pages=sum(len(pages) for pages in missing.values()))
+        for page_backend, missing_pages in missing.items():
+            with tempfile.TemporaryDirectory() as render_folder:
+                render_variables = dict(sheet_variables)
+                render_variables[shard_key] = [item for item, _ in missing_pages]
+                rendered_file = f'{render_folder}/pages.pdf'
+                generate_sharded_template_to_pdf(template_file, render_variables, shard_key, rendered_file, page_size,
+                                                 orientation, workers, page_backend)
+
+                reader = pypdf.PdfReader(rendered_file)
+                if len(reader.pages) != len(missing_pages):
+                    # Some item did not fit on one page, so we can not split the result. Render everything instead.
+                    generate_sharded_template_to_pdf(template_file, sheet_variables, shard_key, output_file,
+                                                     page_size, orientation, workers, backend)
+                    _write_page_references(cache_folder, output_name, [], True)
+                    return
+
+                for page, (_, page_file) in zip(reader.pages, missing_pages):
+                    writer = pypdf.PdfWriter()
+                    writer.add_page(page)
+                    # Other processes might be writing the same page, which is fine since the temporary file is unique
+                    with atomic_write(page_file, 'wb') as pdf_file:
+                        writer.write(pdf_file)
+
+        merge_pdfs(page_files, output_file)
+    _write_page_references(cache_folder, output_name, cached_pages, True)
+
+
+@profiled()
+def _render_spool_batch(batch: tuple) -> str:
+    template_file, sheet_variables, shard_key, output_file, page_size, cache_folder, backend, key = batch
+    temporary_file = f'{output_file}.{os.getpid()}.tmp'
+    if cache_folder and pypdf is not None:
+        generate_cached_template_to_pdf(template_file, sheet_variables, shard_key, temporary_file, page_size,
+                                        cache_folder, backend=backend, output_name=output_file)
+    else:
+        generate_template_to_pdf(template_file, sheet_variables, temporary_file, page_size, backend=backend)
+    os.replace(temporary_file, output_file)
+    # The marker tells printers the batch is complete, and a rerun whether the batch changed
+    with open(f'{output_file}.done', 'w') as f:
+        f.write(key)
+    return output_file
+
+
+def _spool_batch_key(template: 'jinja2.Template', batch_variables: dict, page_size: str, backend: str) -> str:
+    digest = hashlib.sha256(template.render(batch_variables).encode())
+    digest.update(f'\0{page_size}\0{backend}'.encode())
+    # The HTML only refers to the banner by path, so also include its content
+    banner = batch_variables.get('banner')
+    if banner and os.path.isfile(banner):
+        digest.update(file_digest(banner).encode())
+    return digest.hexdigest()
+
+
+@profiled()
+def spool_template_to_pdf(template_file: str, sheet_variables: dict, shard_key: str, spool_folder: str,
+                          page_size: str, batch_size: int = 100, group_by: typing.Optional[str] = None,
+                          workers: int = 1, cache_folder: typing.Optional[str] = None,
+                          backend: str = 'native') -> typing.List[str]:
+    """Write the given content using the given template as numbered batch PDFs into the spool folder.
+
+    The items in `sheet_variables[shard_key]` are grouped on the given attribute, if any, and split into batches of at
+    most `batch_size` items. Every batch is written as `NNNN.pdf` (or `NNNN-group.pdf`) as soon as it is rendered,
+    followed by a `.done` marker next to it, so printers can start on finished batches while the others are still
+    rendering. When all batches are written, an `all.done` marker is written. Returns the batch files in order.
+
+    The `.done` marker holds a hash of the batch, so a rerun skips the batches that are done and did not change, like
+    after an interrupted run. The other batches of an earlier run are removed, so they are not printed again."""
+
+    os.makedirs(spool_folder, exist_ok=True)
+
+    groups: typing.Dict[typing.Any, list] = {}
+    for item in sheet_variables[shard_key]:
+        groups.setdefault(getattr(item, group_by) if group_by else None, []).append(item)
+
+    template = load_template(template_file)
+    batches = []
+    for group, items in groups.items():
+        label = ''
+        if group_by:
+            label = '-' + (re.sub('[^A-Za-z0-9_.-]+', '_', str(group or '')).strip('_')[:40] or 'none')
+        for chunk in chunked(items, batch_size):
+            batch_variables = dict(sheet_variables)
+            batch_variables[shard_key] = chunk
+            batches.append((template_file, batch_variables, shard_key,
+                            f'{spool_folder}/{len(batches) + 1:04d}{label}.pdf', page_size,
+                            f'{cache_folder}/pages' if cache_folder else None, backend,
+                            _spool_batch_key(template, batch_variables, page_size, backend)))
+
+    done = set()
+    for batch in batches:
+        try:
+            with open(f'{batch[3]}.done') as f:
+                if f.read() == batch[7] and os.path.isfile(batch[3]):
+                    done.add(batch[3])
+        except OSError:
+            pass
+    for entry in os.scandir(spool_folder):
+        if re.match(r'^(\d{4}(-.*)?\.pdf(\.done)?|all\.done)$', entry.name) and \
+                entry.path.removesuffix('.done') not in done:
+            os.remove(entry.path)
+    if done:
+        print(f'Skipping {len(done)} unchanged spooled batches in {spool_folder}')
+    missing = [batch for batch in batches if batch[3] not in done]
+    profiler.count(pages=len(sheet_variables[shard_key]), batches=len(batches), rendered=len(missing))
+
+    if workers < 1:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(missing) <= 1:
+        for batch in missing:
+            print(f'Spooled {_render_spool_batch(batch)}')
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(missing))) as executor:
+            for future in concurrent.futures.as_completed([executor.submit(_render_spool_batch, batch)
+                                                           for batch in missing]):
+                print(f'Spooled {future.result()}')
+
+    open(f'{spool_folder}/all.done', 'w').close()
+    return [batch[3] for batch in batches]
+
+
+def spool_folder_for(spool: SpoolConfig, output_file: str) -> str:
+    """Return the folder to spool the batches of the given output file to"""
+
+    return f'{spool.folder}/{os.path.splitext(os.path.basename(output_file))[0]}'
+
+
+def merge_pdfs(input_files: typing.Sequence[str], output_file: str) -> None:
+    """Concatenate the given PDF files in order into the output file"""
+
+    writer = pypdf.PdfWriter()
+    for input_file in input_files:
+        writer.append(input_file)
+    if hasattr(writer, 'compress_identical_objects'):
+        # Pages rendered separately all contain their own copy of for example the banner, only keep one
+        writer.compress_identical_objects()
+    with open(output_file, 'wb') as pdf_file:
+        writer.write(pdf_file)
 
 
 def chunked(data: list, per_chunk: int) -> list:
@@ -664,90 +2754,383 @@ def add_account_type_data(sheet_variables: typing.Dict[str, typing.Any],
     return sheet_variables
 
 
-def write_accounts_yaml(output_folder: str, accounts: typing.Dict[str, Account], prefix_file: bool = True,
-                        possible_contest_dirs: typing.Sequence[str] = None) -> None:
-    if prefix_file:
-        output_file = f'{output_folder}/{output_folder}.accounts.yaml'
-    else:
-        output_file = f'{output_folder}/accounts.yaml'
-    write_yaml_file(output_file, [account.to_yaml_dict() for account in accounts.values()])
+class ExportSink(object):
+    """File format accounts can be exported to using `export_accounts`.
 
-    print(f'Written accounts YAML to {output_file}')
+    A sink gets the accounts in chunks, in order, and writes them to its own file. Sinks can keep state while writing,
+    so use a new sink for every export."""
 
-    if possible_contest_dirs:
-        for contest_dir in possible_contest_dirs:
-            if os.path.isdir(contest_dir):
-                contest_accounts_yaml = f'{contest_dir}/accounts.yaml'
-                if os.path.exists(contest_accounts_yaml):
-                    os.remove(contest_accounts_yaml)
-                shutil.copy(output_file, contest_accounts_yaml)
-
-                print(f'YAML copied to {contest_accounts_yaml}')
-                break
+    description: str = 'accounts'
+    output_file: str
 
+    def __init__(self, output_file: str) -> None:
+        self.output_file = output_file
 
-def write_accounts_tsv(output_folder: str, accounts: typing.Dict[str, Account],
-                       possible_contest_dirs: typing.Sequence[str] = None) -> None:
-    output_file = f'{output_folder}/{output_folder}.accounts.tsv'
-    with open(output_file, 'w') as f:
-        writer = csv.writer(f, delimiter='\t')
-        writer.writerow(['accounts', 1])
-        for account in accounts.values():
-            writer.writerow([
-                account.type,
-                account.name,
-                account.username,
-                account.password
-            ])
+    def begin(self, file: typing.IO) -> None:
+        """Write anything that comes before the accounts"""
 
-    print(f'Written accounts TSV to {output_file}')
+    def write(self, file: typing.IO, accounts: typing.List[Account]) -> None:
+        raise NotImplementedError
 
-    if possible_contest_dirs:
-        for contest_dir in possible_contest_dirs:
-            if os.path.isdir(contest_dir):
-                contest_accounts_tsv = f'{contest_dir}/accounts.tsv'
-                if os.path.exists(contest_accounts_tsv):
-                    os.remove(contest_accounts_tsv)
-                shutil.copy(output_file, contest_accounts_tsv)
-
-                print(f'TSV copied to {contest_accounts_tsv}')
-                break
+    def end(self, file: typing.IO) -> None:
+        """Write anything that comes after the accounts"""
+
+
+class YamlAccountsSink(ExportSink):
+    """The accounts.yaml file of the CCS specification, as read by for example DOMjudge"""
+
+    description = 'accounts YAML'
+    written: bool = False
+
+    def write(self, file: typing.IO, accounts: typing.List[Account]) -> None:
+        yaml.dump([account.to_yaml_dict() for account in accounts], file, Dumper=YamlDumper, sort_keys=False)
+        self.written = True
+
+    def end(self, file: typing.IO) -> None:
+        if not self.written:
+            yaml.dump([], file, Dumper=YamlDumper)
+
+
+class TsvAccountsSink(ExportSink):
+    """The legacy accounts.tsv file, see https://ccs-specs.icpc.io/2020-03/ccs_system_requirements#accountstsv"""
+
+    description = 'accounts TSV'
+    writer: typing.Any = None
+
+    def begin(self, file: typing.IO) -> None:
+        self.writer = csv.writer(file, delimiter='\t')
+        self.writer.writerow(['accounts', 1])
+
+    def write(self, file: typing.IO, accounts: typing.List[Account]) -> None:
+        self.writer.writerows([account.type, account.name, account.username, account.password] for account in accounts)
 
 
-def write_linux_accounts(output_folder: str, accounts: typing.Dict[str, Account]) -> None:
-    output_file = f'{output_folder}/linux-accounts.yaml'
-    unix_accounts = {'users': {account.username: account.password for account in accounts.values() if account.linux}}
-    write_yaml_file(output_file, unix_accounts)
+class LinuxAccountsSink(ExportSink):
+    """YAML file with the plaintext passwords of the Linux accounts under `users`"""
 
-    print(f'Written Linux accounts to {output_file}')
+    description = 'Linux accounts'
+    written: bool = False
 
+    def write(self, file: typing.IO, accounts: typing.List[Account]) -> None:
+        users = {account.username: account.password for account in accounts if account.linux}
+        if not users:
+            return
+        if not self.written:
+            file.write('users:\n')
+            self.written = True
+        # Dump the chunk on its own and indent it, which gives the same result as dumping it under `users`
+        dumped = yaml.dump(users, Dumper=YamlDumper, sort_keys=False)
+        file.write(''.join(f'  {line}' for line in dumped.splitlines(keepends=True)))
 
-def write_codeforces_sheet(output_folder: str, accounts: typing.Dict[str, Account]) -> None:
-    output_file = f'{output_folder}/codeforces-credentials.csv'
+    def end(self, file: typing.IO) -> None:
+        if not self.written:
+            yaml.dump({'users': {}}, file, Dumper=YamlDumper, sort_keys=False)
 
-    with open(output_file, 'w') as f:
-        f.write('\ufeff')
-        writer = csv.writer(f)
-        writer.writerow(['team id', 'display name', 'login', 'password'])
-        for account in accounts.values():
+
+class CodeforcesSink(ExportSink):
+    """CSV file to import the accounts into Codeforces"""
+
+    description = 'Codeforces credentials'
+    writer: typing.Any = None
+
+    def begin(self, file: typing.IO) -> None:
+        file.write('\ufeff')
+        self.writer = csv.writer(file)
+        self.writer.writerow(['team id', 'display name', 'login', 'password'])
+
+    def write(self, file: typing.IO, accounts: typing.List[Account]) -> None:
+        for account in accounts:
             team_id = ''
             if 'team' in account.username:
                 team_id = account.username.replace('team', '')
-            writer.writerow([
+            self.writer.writerow([
                 team_id,
                 account.name,
                 account.username,
                 account.password
             ])
 
-    print(f'Written Codeforces credentials to {output_file}')
 
+class CcsAccountsJsonSink(ExportSink):
+    """The accounts.json file of the CCS contest API, as a JSON list with one account per line"""
+
+    description = 'CCS accounts JSON'
+    written: bool = False
+
+    def begin(self, file: typing.IO) -> None:
+        file.write('[')
+
+    def write(self, file: typing.IO, accounts: typing.List[Account]) -> None:
+        for account in accounts:
+            data = {'id': str(account.id), 'username': account.username, 'password': account.password,
+                    'type': account.type, 'name': account.name}
+            if account.team_id is not None:
+                data['team_id'] = str(account.team_id)
+            if account.ip is not None:
+                data['ip'] = account.ip
+            file.write(f'{"," if self.written else ""}\n{json.dumps(data, ensure_ascii=False)}')
+            self.written = True
+
+    def end(self, file: typing.IO) -> None:
+        file.write('\n]\n' if self.written else ']\n')
+
+
+class JsonLinesSink(ExportSink):
+    """JSON lines file with all known fields of every account, for other tools to process"""
+
+    description = 'accounts JSON lines'
+
+    def write(self, file: typing.IO, accounts: typing.List[Account]) -> None:
+        file.writelines(
+            json.dumps({field: getattr(account, field) for field in Account.__slots__
+                        if getattr(account, field) is not None}, ensure_ascii=False) + '\n'
+            for account in accounts)
+
+
+# Additional formats accounts of contests and the challenge can be exported to, with the extension of their file
+EXPORT_FORMATS = {
+    'ccs-json': (CcsAccountsJsonSink, 'accounts.json'),
+    'jsonl': (JsonLinesSink, 'accounts.jsonl'),
+}
+
+
+def export_format_sinks(output_folder: str, export_formats: typing.Sequence[str]) -> typing.Dict[str, ExportSink]:
+    """Return a sink per output file for the given additional export formats"""
+
+    sinks = {}
+    for export_format in export_formats:
+        sink_class, extension = EXPORT_FORMATS[export_format]
+        output_file = f'{output_folder}/{output_folder}.{extension}'
+        sinks[output_file] = sink_class(output_file)
+    return sinks
+
+
+@profiled()
+def export_accounts(accounts: typing.Iterable[Account], sinks: typing.Sequence[ExportSink],
+                    per_chunk: int = 500) -> None:
+    """Write the given accounts to all given sinks, going over the accounts only once.
+
+    The accounts are handed to all sinks in chunks, which the sinks write concurrently. All files are written to
+    temporary files first, which are only moved in place when all sinks are done. So if any sink fails, none of the
+    files are replaced."""
+
+    if not sinks:
+        return
+
+    number_of_accounts = 0
+    with atomic_write_all([sink.output_file for sink in sinks]) as files, contextlib.ExitStack() as stack:
+        for sink, file in zip(sinks, files):
+            sink.begin(file)
+
+        executor = None
+        if len(sinks) > 1:
+            executor = stack.enter_context(concurrent.futures.ThreadPoolExecutor(max_workers=len(sinks)))
+        for chunk in iter_chunked(accounts, per_chunk):
+            number_of_accounts += len(chunk)
+            if executor:
+                # Consume the results, so errors are raised here
+                list(executor.map(lambda sink, file: sink.write(file, chunk), sinks, files))
+            else:
+                sinks[0].write(files[0], chunk)
+
+        for sink, file in zip(sinks, files):
+            sink.end(file)
+
+    profiler.count(accounts=number_of_accounts, sinks=len(sinks))
+    for sink in sinks:
+        print(f'Written {sink.description} to {sink.output_file}')
+
+
+def deploy_to_contest(output_file: str, name: str, possible_contest_dirs: typing.Sequence[str], deploy_method: str,
+                      description: str) -> None:
+    """Deploy the given file under the given name to the first of the given contest folders that exists"""
+
+    for contest_dir in possible_contest_dirs:
+        if os.path.isdir(contest_dir):
+            target = f'{contest_dir}/{name}'
+            method = deploy_file(output_file, target, deploy_method)
+
+            if method != 'unchanged':
+                print(f'{description} deployed to {target} ({method})')
+            break
+
+
+@profiled()
+def write_accounts_yaml(output_folder: str, accounts: AccountStore, prefix_file: bool = True,
+                        possible_contest_dirs: typing.Sequence[str] = None, deploy_method: str = 'auto') -> None:
+    if prefix_file:
+        output_file = f'{output_folder}/{output_folder}.accounts.yaml'
+    else:
+        output_file = f'{output_folder}/accounts.yaml'
+    export_accounts(accounts.values(), [YamlAccountsSink(output_file)])
+
+    if possible_contest_dirs:
+        deploy_to_contest(output_file, 'accounts.yaml', possible_contest_dirs, deploy_method, 'YAML')
+
+
+@profiled()
+def write_accounts_tsv(output_folder: str, accounts: AccountStore,
+                       possible_contest_dirs: typing.Sequence[str] = None, deploy_method: str = 'auto') -> None:
+    output_file = f'{output_folder}/{output_folder}.accounts.tsv'
+    export_accounts(accounts.values(), [TsvAccountsSink(output_file)])
+
+    if possible_contest_dirs:
+        deploy_to_contest(output_file, 'accounts.tsv', possible_contest_dirs, deploy_method, 'TSV')
+
+
+@profiled()
+def write_linux_accounts(output_folder: str, accounts: AccountStore) -> None:
+    export_accounts(accounts.values(), [LinuxAccountsSink(f'{output_folder}/linux-accounts.yaml')])
+
+
+# Supported password hashes, with their crypt(3) prefix
+PASSWORD_HASHES = {
+    'sha512': '$6$',
+}
+
+_CRYPT_ALPHABET = './0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+# Order in which the bytes of the final SHA-512 digest are encoded, three at a time
+_SHA512_CRYPT_ORDER = [(0, 21, 42), (22, 43, 1), (44, 2, 23), (3, 24, 45), (25, 46, 4), (47, 5, 26), (6, 27, 48),
+                       (28, 49, 7), (50, 8, 29), (9, 30, 51), (31, 52, 10), (53, 11, 32), (12, 33, 54), (34, 55, 13),
+                       (56, 14, 35), (15, 36, 57), (37, 58, 16), (59, 17, 38), (18, 39, 60), (40, 61, 19),
+                       (62, 20, 41)]
+
+
+def _sha512_crypt(password: str, salt: str, rounds: int = 5000) -> str:
+    """Pure Python SHA-512 crypt, for Python versions without the crypt module"""
+
+    p = password.encode()
+    s = salt.encode()[:16]
+    b = hashlib.sha512(p + s + p).digest()
+    a = p + s + b * (len(p) // 64) + b[:len(p) % 64]
+    length = len(p)
+    while length:
+        a += b if length & 1 else p
+        length >>= 1
+    a = hashlib.sha512(a).digest()
+    dp = hashlib.sha512(p * len(p)).digest()
+    p_bytes = (dp * (len(p) // 64 + 1))[:len(p)]
+    ds = hashlib.sha512(s * (16 + a[0])).digest()
+    s_bytes = (ds * (len(s) // 64 + 1))[:len(s)]
+
+    c = a
+    for i in range(rounds):
+        data = p_bytes if i & 1 else c
+        if i % 3:
+            data += s_bytes
+        if i % 7:
+            data += p_bytes
+        data += c if i & 1 else p_bytes
+        c = hashlib.sha512(data).digest()
+
+    encoded = []
+    for triplet in _SHA512_CRYPT_ORDER + [(None, None, 63)]:
+        value = 0
+        for index in triplet:
+            value = (value << 8) | (c[index] if index is not None else 0)
+        for _ in range(4 if triplet[0] is not None else 2):
+            encoded.append(_CRYPT_ALPHABET[value & 0x3f])
+            value >>= 6
+    prefix = '$6$' if rounds == 5000 else f'$6$rounds={rounds}$'
+    return f'{prefix}{s.decode()}${"".join(encoded)}'
+
+
+def hash_password(password: str, method: str = 'sha512') -> str:
+    """Return a salted crypt(3) hash of the given password, as used in /etc/shadow"""
+
+    salt = ''.join(secrets.choice(_CRYPT_ALPHABET) for _ in range(16))
+    with warnings.catch_warnings():
+        # The crypt module is deprecated, but a lot faster when it exists
+        warnings.simplefilter('ignore', DeprecationWarning)
+        try:
+            import crypt
+        except ImportError:
+            crypt = None
+    if crypt is not None:
+        hashed = crypt.crypt(password, f'{PASSWORD_HASHES[method]}{salt}')
+        if hashed and hashed.startswith(PASSWORD_HASHES[method]):
+            return hashed
+    return _sha512_crypt(password, salt)
+
+
+def _hash_passwords(passwords: typing.Sequence[str], method: str) -> typing.List[str]:
+    return [hash_password(password, method) for password in passwords]
+
+
+@profiled()
+def write_linux_password_hashes(output_folder: str, accounts: AccountStore, method: str = 'sha512',
+                                cache_folder: typing.Optional[str] = None, workers: int = 0) -> None:
+    """Write the Linux accounts with hashed passwords, in the format `chpasswd -e` reads.
+
+    Hashing is slow on purpose, so the hashes are computed in a process pool and kept in the cache folder per username
+    and password. A run then only hashes accounts that are new or got a new password. The cache is keyed by an HMAC with
+    a random secret of that cache, so its keys can not be looked up in precomputed tables. They are still a lot faster
+    to guess than the hashes themselves, so protect the cache as you would protect the passwords."""
+
+    output_file = f'{output_folder}/linux-accounts.chpasswd'
+    linux_accounts = [account for account in accounts.values() if account.linux]
+
+    cache_file = f'{cache_folder}/password-hashes/{output_folder.replace("/", "_")}.json' if cache_folder else None
+    cached: typing.Dict[str, str] = {}
+    secret = secrets.token_bytes(32)
+    if cache_file:
+        try:
+            with open(cache_file) as f:
+                cache = json.load(f)
+            secret = bytes.fromhex(cache['secret'])
+            cached = cache['hashes']
+        except (OSError, ValueError, KeyError, TypeError):
+            # Missing, damaged or written by an older version. Start over with a new secret
+            pass
+
+    def cache_key(account: Account) -> str:
+        return hmac.new(secret, f'{method}\0{account.username}\0{account.password}'.encode(),
+                        hashlib.sha256).hexdigest()
+
+    hashes = {}
+    missing = []
+    for account in linux_accounts:
+        key = cache_key(account)
+        if key in cached:
+            hashes[key] = cached[key]
+        else:
+            missing.append(account)
+
+    if missing:
+        if workers < 1:
+            workers = os.cpu_count() or 1
+        passwords = [account.password for account in missing]
+        per_chunk = max(math.ceil(len(passwords) / (workers * 4)), 1)
+        chunks = chunked(passwords, per_chunk)
+        if workers == 1 or len(chunks) == 1:
+            hashed = [_hash_passwords(chunk, method) for chunk in chunks]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+                hashed = list(executor.map(_hash_passwords, chunks, [method] * len(chunks)))
+        for account, password_hash in zip(missing, (h for chunk in hashed for h in chunk)):
+            hashes[cache_key(account)] = password_hash
+
+    with atomic_write(output_file, permissions=0o600) as f:
+        for account in linux_accounts:
+            f.write(f'{account.username}:{hashes[cache_key(account)]}\n')
+
+    if cache_file and missing:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with atomic_write(cache_file, permissions=0o600) as f:
+            json.dump({'secret': secret.hex(), 'hashes': hashes}, f)
+
+    profiler.count(accounts=len(linux_accounts), hashed=len(missing))
+    print(f'Written {len(linux_accounts)} Linux password hashes ({len(missing)} new) to {output_file}')
+
+
+def password_sheet_variables(accounts: typing.Iterable[Account], title: typing.Optional[str],
+                             footer: typing.Optional[str], banner: typing.Optional[str],
+                             account_types: AccountTypesConfig, page_size: str) -> typing.Dict[str, typing.Any]:
+    """Return the template variables for the password sheets of the given accounts, one page per account"""
 
-def write_password_sheets(template: str, output_file: str, accounts: typing.Dict[str, Account],
-                          title: typing.Optional[str], footer: typing.Optional[str], banner: typing.Optional[str],
-                          account_types: AccountTypesConfig, page_size: str) -> None:
     sheet_variables = {
-        'accounts': [account for _, account in accounts.items()],
+        'accounts': list(accounts),
         'title': title,
         'footer': footer,
         'page_size': page_size,
@@ -759,22 +3142,21 @@ def write_password_sheets(template: str, output_file: str, accounts: typing.Dict
     if banner:
         sheet_variables['banner'] = os.path.abspath(banner)
 
-    sheet_variables = add_account_type_data(sheet_variables, account_types)
+    return add_account_type_data(sheet_variables, account_types)
 
-    generate_template_to_pdf(template, sheet_variables, output_file, page_size)
-    print(f'Written password sheets to {output_file}')
 
+def master_sheet_variables(accounts: typing.Iterable[Account], title: typing.Optional[str],
+                           footer: typing.Optional[str], account_types: AccountTypesConfig,
+                           page_size: str) -> typing.Dict[str, typing.Any]:
+    """Return the template variables for the master password list of the team accounts in the given accounts"""
 
-def write_master_file(template: str, output_file: str, accounts: typing.Dict[str, Account],
-                      title: typing.Optional[str], footer: typing.Optional[str], account_types: AccountTypesConfig,
-                      page_size: str) -> None:
     if page_size == 'A4':
         rows_per_page = 40
     else:
         rows_per_page = 41
     columns_per_page = 3
     per_page = rows_per_page * columns_per_page
-    accounts_to_include = [account for account in accounts.values() if account.type == "team"]
+    accounts_to_include = [account for account in accounts if account.type == "team"]
     pages = [chunked(page, rows_per_page) for page in chunked(accounts_to_include, per_page)]
 
     sheet_variables = {
@@ -789,15 +3171,55 @@ def write_master_file(template: str, output_file: str, accounts: typing.Dict[str
         'linux': False,
     }
 
-    sheet_variables = add_account_type_data(sheet_variables, account_types)
+    return add_account_type_data(sheet_variables, account_types)
+
+
+@profiled()
+def write_password_sheets(template: str, output_file: str, accounts: AccountStore,
+                          title: typing.Optional[str], footer: typing.Optional[str], banner: typing.Optional[str],
+                          account_types: AccountTypesConfig, page_size: str, workers: int = 1,
+                          cache_folder: typing.Optional[str] = None, backend: str = 'native',
+                          spool: typing.Optional[SpoolConfig] = None) -> None:
+    banner = prepare_banner(banner, page_size, cache_folder)
+    sheet_variables = password_sheet_variables(accounts.values(), title, footer, banner, account_types, page_size)
+    profiler.count(accounts=len(sheet_variables['accounts']), pages=len(sheet_variables['accounts']))
+
+    if spool:
+        # Spool first, so printing can start right away. With the page cache, the full document below is then only
+        # assembled from the cached pages
+        spool_template_to_pdf(template, sheet_variables, 'accounts', spool_folder_for(spool, output_file), page_size,
+                              spool.batch_size, spool.group_by, workers, cache_folder, backend)
+
+    if cache_folder and pypdf is not None:
+        generate_cached_template_to_pdf(template, sheet_variables, 'accounts', output_file, page_size,
+                                        f'{cache_folder}/pages', workers=workers, backend=backend)
+        prune_page_cache(f'{cache_folder}/pages')
+    else:
+        generate_sharded_template_to_pdf(template, sheet_variables, 'accounts', output_file, page_size,
+                                         workers=workers, backend=backend)
+    print(f'Written password sheets to {output_file}')
+
 
-    generate_template_to_pdf(template, sheet_variables, output_file, page_size, 'Landscape')
+@profiled()
+def write_master_file(template: str, output_file: str, accounts: AccountStore,
+                      title: typing.Optional[str], footer: typing.Optional[str], account_types: AccountTypesConfig,
+                      page_size: str, workers: int = 1, backend: str = 'native') -> None:
+    sheet_variables = master_sheet_variables(accounts.values(), title, footer, account_types, page_size)
+    pages = sheet_variables['pages']
+    profiler.count(accounts=sum(len(column) for page in pages for column in page), pages=len(pages))
+
+    generate_sharded_template_to_pdf(template, sheet_variables, 'pages', output_file, page_size, 'Landscape', workers,
+                                     backend)
     print(f'Written master file to {output_file}')
 
 
+@profiled()
 def write_cds_password_sheets(template: str, output_file: str, cds_config: CdsConfigFile,
-                              accounts_per_server: typing.Dict[str, typing.Dict[str, Account]],
-                              footer: typing.Optional[str], banner: typing.Optional[str], page_size: str) -> None:
+                              accounts_per_server: typing.Dict[str, AccountStore],
+                              footer: typing.Optional[str], banner: typing.Optional[str], page_size: str,
+                              workers: int = 1, cache_folder: typing.Optional[str] = None,
+                              backend: str = 'native', spool: typing.Optional[SpoolConfig] = None) -> None:
+    banner = prepare_banner(banner, page_size, cache_folder)
     sheet_variables = {
         'accounts': _prepare_cds_accounts(cds_config, accounts_per_server),
         'footer': footer,
@@ -806,13 +3228,24 @@ def write_cds_password_sheets(template: str, output_file: str, cds_config: CdsCo
 
     if banner:
         sheet_variables['banner'] = os.path.abspath(banner)
+    profiler.count(accounts=len(sheet_variables['accounts']), pages=len(sheet_variables['accounts']))
+
+    if spool:
+        spool_template_to_pdf(template, sheet_variables, 'accounts', spool_folder_for(spool, output_file), page_size,
+                              spool.batch_size, spool.group_by, workers, cache_folder, backend)
 
-    generate_template_to_pdf(template, sheet_variables, output_file, page_size)
+    if cache_folder and pypdf is not None:
+        generate_cached_template_to_pdf(template, sheet_variables, 'accounts', output_file, page_size,
+                                        f'{cache_folder}/pages', workers=workers, backend=backend)
+        prune_page_cache(f'{cache_folder}/pages')
+    else:
+        generate_sharded_template_to_pdf(template, sheet_variables, 'accounts', output_file, page_size,
+                                         workers=workers, backend=backend)
     print(f'Written CDS password sheets to {output_file}')
 
 
 def _prepare_cds_accounts(cds_config: CdsConfigFile,
-                          accounts_per_server: typing.Dict[str, typing.Dict[str, Account]]) -> typing.Sequence[Account]:
+                          accounts_per_server: typing.Dict[str, AccountStore]) -> typing.Sequence[Account]:
     url_per_server = {}
     for server in cds_config.servers:
         url_per_server[server.name] = server.url
@@ -828,9 +3261,11 @@ def _prepare_cds_accounts(cds_config: CdsConfigFile,
     return accounts
 
 
+@profiled()
 def write_cds_master_file(template: str, output_file: str, cds_config: CdsConfigFile,
-                          accounts_per_server: typing.Dict[str, typing.Dict[str, Account]],
-                          footer: typing.Optional[str], page_size: str) -> None:
+                          accounts_per_server: typing.Dict[str, AccountStore],
+                          footer: typing.Optional[str], page_size: str, workers: int = 1,
+                          backend: str = 'native') -> None:
     accounts = _prepare_cds_accounts(cds_config, accounts_per_server)
 
     if page_size == 'A4':
@@ -845,6 +3280,811 @@ def write_cds_master_file(template: str, output_file: str, cds_config: CdsConfig
         'footer': footer,
         'page_size': page_size,
     }
+    profiler.count(accounts=len(accounts), pages=len(pages))
 
-    generate_template_to_pdf(template, sheet_variables, output_file, page_size, 'Landscape')
+    generate_sharded_template_to_pdf(template, sheet_variables, 'pages', output_file, page_size, 'Landscape', workers,
+                                     backend)
     print(f'Written CDS master file to {output_file}')
+
+
+def list_sources(config: Config) -> typing.Dict[str, str]:
+    """Return all sources that can be generated, with a description for each"""
+
+    sources = {n: f'{name} starting at {start_time}' for n, (name, start_time) in config.contests.summaries().items()}
+    if config.cds:
+        sources['cds'] = 'CDS passwords'
+    if config.challenge:
+        sources['challenge'] = 'Challenge passwords'
+    if config.global_config.additional_account_files:
+        for f in config.global_config.additional_account_files:
+            sources[f'file {f}'] = f'Additional accounts in {f}'
+    return sources
+
+
+@profiled()
+def generate_account_file(config: Config, file: str, overwrite: bool = False, dry_run: bool = False) -> None:
+    """Generate missing passwords in the given additional account file"""
+
+    manifest = BuildManifest(config.global_config.cache_folder, f'file {file}')
+
+    def output_keys() -> typing.Dict[str, str]:
+        return {file: manifest.key([file, 'config.yaml', config.global_config.password_key_file, __file__])}
+
+    if not manifest.plan(f'file {file}', output_keys(), overwrite, dry_run):
+        return
+
+    accounts = load_accounts(
+            file,
+            number_of_words_per_password=config.global_config.number_of_words_per_password,
+            regenerate_passwords=overwrite,
+            cache_folder=config.global_config.cache_folder,
+            password_key=config.global_config.password_key(f'file {file}'),
+    )
+    write_yaml_records(file, (account.to_yaml_dict() for account in accounts.values()))
+    print(f'Generated/updated accounts in {file}')
+    manifest.record(output_keys())
+
+
+def add_challenge_accounts(config: Config, accounts: AccountStore,
+                           password_key: typing.Optional[PasswordKey] = None) -> AccountStore:
+    """Add the teams of all account files of the challenge to the given accounts, with their organization and Linux
+    setting. Existing accounts keep their password"""
+
+    number_of_words_per_password = config.challenge.option_or_global('number_of_words_per_password',
+                                                                     config.global_config)
+    ip_prefix = config.challenge.option_or_global('ip_prefix', config.global_config)
+    ip_drop_prefix = config.challenge.option_or_global('ip_drop_prefix', config.global_config)
+
+    # Read all teams and organizations files at once, so files used by multiple account files are only read once
+    preload_json_files([(account_file.teams_file, _read_teams) for account_file in config.challenge.account_files] +
+                       [(account_file.organizations_file, _read_organizations)
+                        for account_file in config.challenge.account_files if account_file.organizations_file])
+    for account_file in config.challenge.account_files:
+        accounts = add_team_accounts(accounts, account_file.teams_file, number_of_words_per_password,
+                                     ip_prefix, ip_drop_prefix, account_file.username_prefix, account_file.name_prefix,
+                                     account_file.organizations_file, account_file.linux, password_key)
+    return accounts
+
+
+@profiled()
+def generate_challenge(config: Config, overwrite: bool = False, dry_run: bool = False,
+                       account_filter: typing.Optional[AccountFilter] = None) -> None:
+    """Generate all files for the challenge.
+
+    An account filter works the same as for contests, see `generate_contest`."""
+
+    config.validate_challenge()
+
+    number_of_words_per_password = config.challenge.option_or_global('number_of_words_per_password',
+                                                                     config.global_config)
+    ip_prefix = config.challenge.option_or_global('ip_prefix', config.global_config)
+    ip_drop_prefix = config.challenge.option_or_global('ip_drop_prefix', config.global_config)
+    footer = config.challenge.option_or_global('footer', config.global_config)
+    account_types = config.challenge.option_or_global('account_types', config.global_config)
+    page_size = config.challenge.option_or_global('page_size', config.global_config)
+    banner = config.challenge.banner
+    sheets_file = 'challenge/challenge_password_sheets.pdf'
+    master_file = 'challenge/challenge_contest_master.pdf'
+    if account_filter:
+        sheets_file = f'challenge/challenge_password_sheets-{account_filter.suffix()}.pdf'
+        master_file = f'challenge/challenge_contest_master-{account_filter.suffix()}.pdf'
+
+    manifest = BuildManifest(config.global_config.cache_folder, 'challenge')
+    # The selected accounts are part of what the filtered sheets are built from
+    filter_values = [account_filter.description()] if account_filter else []
+
+    def output_keys() -> typing.Dict[str, str]:
+        input_files = ['config.yaml', 'challenge/challenge.accounts.yaml', config.global_config.password_key_file,
+                       __file__]
+        for account_file in config.challenge.account_files:
+            input_files += [account_file.teams_file, account_file.organizations_file]
+        data_key = manifest.key(input_files)
+        keys = {
+            'challenge/challenge.accounts.yaml': data_key,
+            sheets_file: manifest.key([template_path('ccs-and-challenge-sheets.html'), banner],
+                                      [data_key, *filter_values]),
+            master_file: manifest.key([template_path('ccs-and-challenge-master.html')],
+                                      [data_key, today_formatted(), *filter_values]),
+        }
+        if account_types.linux and config.global_config.linux_plaintext_passwords:
+            keys['challenge/linux-accounts.yaml'] = data_key
+        if account_types.linux and config.global_config.linux_password_hash:
+            keys['challenge/linux-accounts.chpasswd'] = manifest.key([], [data_key,
+                                                                          config.global_config.linux_password_hash])
+        if account_types.ccs and account_types.ccs.name == 'Codeforces':
+            keys['challenge/codeforces-credentials.csv'] = data_key
+        for output in export_format_sinks('challenge', config.global_config.export_formats):
+            keys[output] = data_key
+        return keys
+
+    stale = manifest.plan('challenge', output_keys(), overwrite, dry_run)
+    if not stale:
+        return
+
+    if not os.path.isdir('challenge'):
+        os.mkdir('challenge')
+
+    password_key = config.global_config.password_key('challenge')
+    accounts = AccountStore()
+    if (not overwrite or account_filter) and not password_key:
+        # Load existing accounts if any. Derived passwords do not depend on them
+        accounts = load_accounts(f'challenge/challenge.accounts.yaml', number_of_words_per_password,
+                                 ip_prefix, ip_drop_prefix, cache_folder=config.global_config.cache_folder)
+
+    accounts = add_challenge_accounts(config, accounts, password_key)
+
+    if overwrite and account_filter:
+        regenerate_passwords(account_filter.select(accounts), number_of_words_per_password, password_key)
+    sheet_accounts = select_accounts(accounts, account_filter)
+
+    # Write all account files in a single pass over the accounts
+    sinks = {
+        'challenge/challenge.accounts.yaml': YamlAccountsSink('challenge/challenge.accounts.yaml'),
+        'challenge/linux-accounts.yaml': LinuxAccountsSink('challenge/linux-accounts.yaml'),
+        'challenge/codeforces-credentials.csv': CodeforcesSink('challenge/codeforces-credentials.csv'),
+        **export_format_sinks('challenge', config.global_config.export_formats),
+    }
+    export_accounts(accounts.values(), [sink for output, sink in sinks.items() if output in stale])
+
+    if sheets_file in stale:
+        write_password_sheets('ccs-and-challenge-sheets.html', sheets_file, sheet_accounts,
+                              config.challenge.title, footer, banner, account_types, page_size,
+                              config.global_config.pdf_workers, config.global_config.cache_folder,
+                              config.global_config.pdf_backend, config.global_config.spool)
+    if master_file in stale:
+        write_master_file('ccs-and-challenge-master.html', master_file, sheet_accounts,
+                          config.challenge.title, footer, account_types, page_size,
+                          config.global_config.pdf_workers, config.global_config.pdf_backend)
+
+    if 'challenge/linux-accounts.chpasswd' in stale:
+        write_linux_password_hashes('challenge', accounts, config.global_config.linux_password_hash,
+                                    config.global_config.cache_folder)
+
+    manifest.record({output: key for output, key in output_keys().items() if output in stale})
+
+
+@profiled()
+def generate_cds(config: Config, overwrite: bool = False, dry_run: bool = False) -> None:
+    """Generate all files for the CDS"""
+
+    config.validate_cds()
+
+    number_of_words_per_password = config.cds.option_or_global('number_of_words_per_password', config.global_config)
+    footer = config.cds.option_or_global('footer', config.global_config)
+    page_size = config.cds.option_or_global('page_size', config.global_config)
+    banner = config.cds.banner
+
+    cds_config_file = load_cds_config_file(config.cds.config)
+
+    manifest = BuildManifest(config.global_config.cache_folder, 'cds')
+
+    def output_keys() -> typing.Dict[str, str]:
+        account_files = [f'cds/{server.name}/config/accounts.yaml' for server in cds_config_file.servers]
+        data_key = manifest.key(['config.yaml', config.cds.config, *account_files,
+                                 config.global_config.password_key_file, __file__])
+        keys = {account_file: data_key for account_file in account_files}
+        keys['cds/CDS_password_sheets.pdf'] = manifest.key([template_path('cds-sheets.html'), banner], [data_key])
+        keys['cds/CDS_master.pdf'] = manifest.key([template_path('cds-master.html')], [data_key, today_formatted()])
+        if config.cds.servers_folder:
+            for server in cds_config_file.servers:
+                keys[f'{config.cds.servers_folder}/{server.name}/config/accounts.yaml'] = data_key
+        return keys
+
+    stale = manifest.plan('cds', output_keys(), overwrite, dry_run)
+    if not stale:
+        return
+
+    if not os.path.isdir('cds'):
+        os.mkdir('cds')
+
+    if config.cds.servers_folder and not os.path.isdir(config.cds.servers_folder):
+        os.mkdir(config.cds.servers_folder)
+
+    accounts_per_server = {}
+    for server in cds_config_file.servers:
+        accounts_per_server[server.name] = AccountStore()
+
+    password_key = config.global_config.password_key('cds')
+
+    # Load existing accounts when we are generating and not overwriting. Derived passwords do not depend on them
+    if not overwrite and not password_key:
+        for server in cds_config_file.servers:
+            account_file = f'cds/{server.name}/config/accounts.yaml'
+            if os.path.isfile(account_file):
+                accounts_per_server[server.name] = load_accounts(account_file, number_of_words_per_password, None,
+                                                                 None, accounts_per_server[server.name], False,
+                                                                 config.global_config.cache_folder)
+
+    passwords_per_account = {}
+
+    # Now generate (new) accounts
+    for account in cds_config_file.accounts:
+        for server in account.servers:
+            if server not in accounts_per_server:
+                print(f'Account {account.username} has an unknown server {server}')
+                exit(1)
+
+            # Only add accounts if they don't exist yet
+            if account.username not in accounts_per_server[server]:
+                added_account = Account(account.username, account.name, account.type, account.username)
+                if account.username in passwords_per_account:
+                    added_account.password = passwords_per_account[account.username]
+                else:
+                    added_account.generate_password(number_of_words_per_password, password_key)
+                    passwords_per_account[account.username] = added_account.password
+                accounts_per_server[server].upsert(added_account)
+            else:
+                accounts_per_server[server][account.username].name = account.name
+
+    # Write the CDS account files
+    for server in cds_config_file.servers:
+        cds_folder = f'cds/{server.name}'
+        if not os.path.isdir(cds_folder):
+            os.mkdir(cds_folder)
+        config_folder = f'{cds_folder}/config'
+        if not os.path.isdir(config_folder):
+            os.mkdir(config_folder)
+
+        if f'{config_folder}/accounts.yaml' in stale:
+            write_accounts_yaml(config_folder, accounts_per_server[server.name], False)
+
+    if 'cds/CDS_password_sheets.pdf' in stale:
+        write_cds_password_sheets('cds-sheets.html', 'cds/CDS_password_sheets.pdf', cds_config_file,
+                                  accounts_per_server, footer, banner, page_size, config.global_config.pdf_workers,
+                                  config.global_config.cache_folder, config.global_config.pdf_backend,
+                                  config.global_config.spool)
+    if 'cds/CDS_master.pdf' in stale:
+        write_cds_master_file('cds-master.html', 'cds/CDS_master.pdf', cds_config_file, accounts_per_server,
+                              footer, page_size, config.global_config.pdf_workers, config.global_config.pdf_backend)
+
+    if config.cds.servers_folder:
+        deployments = []
+        for server in cds_config_file.servers:
+            folder = f'{config.cds.servers_folder}/{server.name}/config'
+            file = f'{folder}/accounts.yaml'
+            if file in stale:
+                os.makedirs(folder, exist_ok=True)
+                deployments.append((server.name, f'cds/{server.name}/config/accounts.yaml', file))
+
+        methods = deploy_files([(source, target) for _, source, target in deployments],
+                               config.global_config.deploy_method)
+        for (server, _, file), method in zip(deployments, methods):
+            print(f'Accounts.yaml deployed to {file} for server {server} ({method})')
+
+    manifest.record({output: key for output, key in output_keys().items() if output in stale})
+
+
+def regenerate_passwords(accounts: AccountStore, number_of_words_per_password: int,
+                         password_key: typing.Optional[PasswordKey] = None) -> None:
+    """Give all given accounts a new password"""
+
+    for account in accounts.values():
+        account.generate_password(number_of_words_per_password, password_key)
+    print(f'Generated new passwords for {len(accounts)} accounts')
+
+
+def select_accounts(accounts: AccountStore, account_filter: typing.Optional[AccountFilter]) -> AccountStore:
+    """Return the accounts selected by the given filter, or all accounts without a filter.
+
+    Exits when the filter does not select any account, since there is nothing to generate for it then."""
+
+    if not account_filter:
+        return accounts
+    selected = account_filter.select(accounts)
+    if not selected:
+        print(f'No accounts match {account_filter.description()}')
+        exit(1)
+    print(f'Selected {len(selected)} of {len(accounts)} accounts matching {account_filter.description()}')
+    return selected
+
+
+def contest_banner(contest_folder: str) -> typing.Optional[str]:
+    """Return the banner of the contest in the given folder, if it has any"""
+
+    banner_files = [
+        f'{contest_folder}/contest/banner.jpg',
+        f'{contest_folder}/contest/banner.png',
+        f'{contest_folder}/banner.jpg',
+        f'{contest_folder}/banner.png',
+        f'{contest_folder}/config/banner.jpg',
+        f'{contest_folder}/config/banner.png',
+    ]
+    for banner_file in banner_files:
+        if os.path.isfile(banner_file):
+            return banner_file
+    return None
+
+
+@profiled()
+def generate_contest(config: Config, contest_name: str, overwrite: bool = False, dry_run: bool = False,
+                     account_filter: typing.Optional[AccountFilter] = None) -> None:
+    """Generate all files for the given contest.
+
+    With an account filter, the password sheets and master file are only generated for the selected accounts, into
+    files with the filter as suffix. When overwriting, only the selected accounts get a new password. The accounts
+    files always contain all accounts."""
+
+    contest = config.contests[contest_name]
+    config.validate_contest(contest_name, contest)
+    if account_filter and account_filter.has_condition('organization'):
+        print(f'Contest accounts do not have an organization, filter {contest_name} on another field like team_id')
+        exit(1)
+
+    number_of_words_per_password = contest.contest_option_or_global('number_of_words_per_password',
+                                                                    config.global_config)
+    ip_prefix = contest.contest_option_or_global('ip_prefix', config.global_config)
+    ip_drop_prefix = contest.contest_option_or_global('ip_drop_prefix', config.global_config)
+    additional_account_files = contest.contest_option_or_global('additional_account_files', config.global_config, [])
+    footer = contest.contest_option_or_global('footer', config.global_config)
+    account_types = contest.contest_option_or_global('account_types', config.global_config)
+    page_size = contest.contest_option_or_global('page_size', config.global_config)
+    generate_accounts_tsv = contest.contest_option_or_global('generate_accounts_tsv', config.global_config)
+
+    contest_folder = f'{config.global_config.contests_folder}/{contest_name}'
+    teams_file = f'{contest_folder}/teams.json'
+    if not os.path.isfile(teams_file):
+        teams_file = f'{contest_folder}/config/teams.json'
+
+    banner = contest_banner(contest_folder)
+
+    accounts_file = f'{contest_name}/{contest_name}.accounts.yaml'
+    tsv_file = f'{contest_name}/{contest_name}.accounts.tsv'
+    linux_file = f'{contest_name}/linux-accounts.yaml'
+    linux_hashes_file = f'{contest_name}/linux-accounts.chpasswd'
+    sheets_file = f'{contest_name}/{contest_name}_password_sheets.pdf'
+    master_file = f'{contest_name}/{contest_name}_contest_master.pdf'
+    if account_filter:
+        sheets_file = f'{contest_name}/{contest_name}_password_sheets-{account_filter.suffix()}.pdf'
+        master_file = f'{contest_name}/{contest_name}_contest_master-{account_filter.suffix()}.pdf'
+    manifest = BuildManifest(config.global_config.cache_folder, contest_name)
+    # The selected accounts are part of what the filtered sheets are built from
+    filter_values = [account_filter.description()] if account_filter else []
+
+    def output_keys() -> typing.Dict[str, str]:
+        data_key = manifest.key(['config.yaml', f'{contest_folder}/contest.yaml',
+                                 f'{contest_folder}/config/contest.yaml', teams_file, accounts_file,
+                                 *additional_account_files, config.global_config.password_key_file, __file__])
+        keys = {
+            accounts_file: data_key,
+            sheets_file: manifest.key([template_path('ccs-and-challenge-sheets.html'), banner],
+                                      [data_key, *filter_values]),
+            master_file: manifest.key([template_path('ccs-and-challenge-master.html')],
+                                      [data_key, today_formatted(), *filter_values]),
+        }
+        if generate_accounts_tsv:
+            keys[tsv_file] = data_key
+        for output in export_format_sinks(contest_name, config.global_config.export_formats):
+            keys[output] = data_key
+        if account_types.linux and config.global_config.linux_plaintext_passwords:
+            keys[linux_file] = data_key
+        if account_types.linux and config.global_config.linux_password_hash:
+            keys[linux_hashes_file] = manifest.key([], [data_key, config.global_config.linux_password_hash])
+        return keys
+
+    def deploy_account_files() -> None:
+        # The deployed files are not outputs of the manifest, so they are checked on every run. This only writes
+        # anything when they are missing or differ from the generated files
+        contest_dirs = [f'{contest_folder}/config', contest_folder]
+        deploy_method = config.global_config.deploy_method
+        deploy_to_contest(accounts_file, 'accounts.yaml', contest_dirs, deploy_method, 'YAML')
+        if generate_accounts_tsv:
+            deploy_to_contest(tsv_file, 'accounts.tsv', contest_dirs, deploy_method, 'TSV')
+
+    stale = manifest.plan(contest_name, output_keys(), overwrite, dry_run)
+    if not stale:
+        if not dry_run:
+            deploy_account_files()
+        return
+
+    if not os.path.isdir(contest_name):
+        os.mkdir(contest_name)
+
+    password_key = config.global_config.password_key(contest_name)
+    accounts = AccountStore()
+    if (not overwrite or account_filter) and not password_key:
+        # Load existing accounts if any. Derived passwords do not depend on them
+        accounts = load_accounts(accounts_file, number_of_words_per_password,
+                                 ip_prefix, ip_drop_prefix, cache_folder=config.global_config.cache_folder)
+
+    accounts = add_team_accounts(accounts, teams_file, number_of_words_per_password, ip_prefix, ip_drop_prefix,
+                                 password_key=password_key)
+    for file in additional_account_files:
+        accounts = load_accounts(file, number_of_words_per_password, ip_prefix, ip_drop_prefix, accounts,
+                                 cache_folder=config.global_config.cache_folder,
+                                 password_key=config.global_config.password_key(f'file {file}'))
+
+    # Only filter once all accounts are known, so accounts from additional account files can be selected too
+    if overwrite and account_filter:
+        regenerate_passwords(account_filter.select(accounts), number_of_words_per_password, password_key)
+
+    sheet_accounts = select_accounts(accounts, account_filter)
+
+    # Write all account files in a single pass over the accounts
+    sinks = {
+        accounts_file: YamlAccountsSink(accounts_file),
+        tsv_file: TsvAccountsSink(tsv_file),
+        linux_file: LinuxAccountsSink(linux_file),
+        **export_format_sinks(contest_name, config.global_config.export_formats),
+    }
+    export_accounts(accounts.values(), [sink for output, sink in sinks.items() if output in stale])
+
+    deploy_account_files()
+
+    if linux_hashes_file in stale:
+        write_linux_password_hashes(contest_name, accounts, config.global_config.linux_password_hash,
+                                    config.global_config.cache_folder)
+
+    if sheets_file in stale:
+        write_password_sheets('ccs-and-challenge-sheets.html', sheets_file, sheet_accounts, contest.config.name,
+                              footer, banner, account_types, page_size, config.global_config.pdf_workers,
+                              config.global_config.cache_folder, config.global_config.pdf_backend,
+                              config.global_config.spool)
+    if master_file in stale:
+        write_master_file('ccs-and-challenge-master.html', master_file, sheet_accounts, contest.config.name, footer,
+                          account_types, page_size, config.global_config.pdf_workers, config.global_config.pdf_backend)
+
+    manifest.record({output: key for output, key in output_keys().items() if output in stale})
+
+
+def generate_source(config: Config, source: str, overwrite: bool = False, dry_run: bool = False,
+                    account_filter: typing.Optional[AccountFilter] = None) -> None:
+    """Generate all files for the given source, as listed by `list_sources`.
+
+    Only files whose inputs changed since they were last generated are rebuilt, unless overwriting. When doing a dry
+    run, only report which files would be rebuilt. With an account filter, which is only supported for contests and
+    the challenge, only the password sheets and master file of the selected accounts are generated."""
+
+    if account_filter and (source.startswith('file ') or source == 'cds'):
+        print(f'Filtering accounts is not supported for {source}')
+        exit(1)
+
+    if source.startswith('file '):
+        generate_account_file(config, source[len('file '):], overwrite, dry_run)
+    elif source == 'challenge' and config.challenge:
+        generate_challenge(config, overwrite, dry_run, account_filter)
+    elif source == 'cds' and config.cds:
+        generate_cds(config, overwrite, dry_run)
+    else:
+        generate_contest(config, source, overwrite, dry_run, account_filter)
+
+
+class SheetServer(object):
+    """Small HTTP server that renders the password sheet of a single account, or a single page of the master list.
+
+    Accounts are read from the generated accounts files, so reprints match what was printed before. For the challenge,
+    the teams and organizations files are joined in the same way as when generating, since the accounts file does not
+    contain the organization and Linux setting of the accounts. These files are loaded again when they change. Loading
+    and rendering happens in a thread pool, so requests do not wait for each other, and the rendered PDFs are kept in a
+    LRU cache. Requests for a PDF that is already being rendered wait for that rendering.
+
+    Available paths:
+    - `/`: list of all sources and accounts
+    - `/<source>/sheet/<username>.pdf`: password sheet of the given account
+    - `/<source>/master/<page>.pdf`: the given page of the master list, starting at 1"""
+
+    config: Config
+    sources: typing.List[str]
+    cache_size: int
+    _accounts: typing.Dict[str, typing.Tuple[tuple, AccountStore]]
+    _cache: 'collections.OrderedDict[tuple, bytes]'
+    _rendering: typing.Dict[tuple, 'asyncio.Future']
+    _executor: concurrent.futures.ThreadPoolExecutor
+
+    def __init__(self, config: Config, sources: typing.Sequence[str], cache_size: int = 256, workers: int = 4) -> None:
+        self.config = config
+        self.sources = list(sources)
+        self.cache_size = cache_size
+        self._accounts = {}
+        self._cache = collections.OrderedDict()
+        self._rendering = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    @staticmethod
+    def supports(source: str) -> bool:
+        return source != 'cds' and not source.startswith('file ')
+
+    def settings(self, source: str) -> typing.Dict[str, typing.Any]:
+        """Return the accounts file and sheet settings of the given source"""
+
+        config = self.config
+        if source == 'challenge':
+            input_files = []
+            for account_file in config.challenge.account_files:
+                input_files += [account_file.teams_file, account_file.organizations_file]
+            return {
+                'accounts_file': 'challenge/challenge.accounts.yaml',
+                'input_files': [file for file in input_files if file],
+                'title': config.challenge.title,
+                'footer': config.challenge.option_or_global('footer', config.global_config),
+                'banner': config.challenge.banner,
+                'account_types': config.challenge.option_or_global('account_types', config.global_config),
+                'page_size': config.challenge.option_or_global('page_size', config.global_config),
+            }
+        contest = config.contests[source]
+        return {
+            'accounts_file': f'{source}/{source}.accounts.yaml',
+            'input_files': [],
+            'title': contest.config.name,
+            'footer': contest.contest_option_or_global('footer', config.global_config),
+            'banner': contest_banner(f'{config.global_config.contests_folder}/{source}'),
+            'account_types': contest.contest_option_or_global('account_types', config.global_config),
+            'page_size': contest.contest_option_or_global('page_size', config.global_config),
+        }
+
+    def accounts(self, source: str) -> typing.Tuple[tuple, AccountStore]:
+        """Return the state of the input files of the given source and its accounts, loading them again if changed"""
+
+        settings = self.settings(source)
+        state = tuple(_file_state(file) for file in [settings['accounts_file'], *settings['input_files']])
+        if source not in self._accounts or self._accounts[source][0] != state:
+            global_config = self.config.global_config
+            accounts = load_accounts(settings['accounts_file'], global_config.number_of_words_per_password,
+                                     cache_folder=global_config.cache_folder)
+            if source == 'challenge':
+                # Only keep the generated accounts, teams added since then do not have a password yet
+                generated = set(accounts)
+                accounts = add_challenge_accounts(self.config, accounts)
+                accounts = AccountStore(account for account in accounts.values() if account.username in generated)
+            self._accounts[source] = (state, accounts)
+        return self._accounts[source]
+
+    def render(self, source: str, kind: str, variables: dict) -> bytes:
+        """Render the given sheet variables of the given source to a PDF and return it"""
+
+        settings = self.settings(source)
+        if kind == 'sheet':
+            template, orientation = 'ccs-and-challenge-sheets.html', 'Portrait'
+        else:
+            template, orientation = 'ccs-and-challenge-master.html', 'Landscape'
+        with tempfile.TemporaryDirectory() as folder:
+            generate_template_to_pdf(template, variables, f'{folder}/{kind}.pdf', settings['page_size'], orientation,
+                                     self.config.global_config.pdf_backend)
+            with open(f'{folder}/{kind}.pdf', 'rb') as pdf_file:
+                return pdf_file.read()
+
+    def _variables(self, source: str, kind: str, name: str,
+                   accounts: AccountStore) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        settings = self.settings(source)
+        if kind == 'sheet':
+            if name not in accounts:
+                return None
+            banner = prepare_banner(settings['banner'], settings['page_size'], self.config.global_config.cache_folder)
+            return password_sheet_variables([accounts[name]], settings['title'], settings['footer'], banner,
+                                            settings['account_types'], settings['page_size'])
+
+        variables = master_sheet_variables(accounts.values(), settings['title'], settings['footer'],
+                                           settings['account_types'], settings['page_size'])
+        pages = variables['pages']
+        if not name.isdigit() or not 1 <= int(name) <= len(pages):
+            return None
+        variables['pages'] = [pages[int(name) - 1]]
+        variables['page_offset'] = int(name) - 1
+        variables['total_pages'] = len(pages)
+        return variables
+
+    async def pdf(self, source: str, kind: str, name: str) -> typing.Optional[bytes]:
+        """Return the PDF for the given path parts, or None if it does not exist"""
+
+        loop = asyncio.get_running_loop()
+        state, accounts = await loop.run_in_executor(self._executor, self.accounts, source)
+        key = (source, kind, name, state, today_formatted())
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        if key not in self._rendering:
+            variables = await loop.run_in_executor(self._executor, self._variables, source, kind, name, accounts)
+            if variables is None:
+                return None
+            # Another request might have started rendering the same PDF in the meantime
+            if key not in self._rendering:
+                self._rendering[key] = loop.run_in_executor(self._executor, self.render, source, kind, variables)
+        try:
+            pdf = await asyncio.shield(self._rendering[key])
+        finally:
+            self._rendering.pop(key, None)
+
+        self._cache[key] = pdf
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return pdf
+
+    def index(self) -> str:
+        lines = ['<!DOCTYPE html><html><head><meta charset="utf-8"><title>Password sheets</title></head><body>']
+        for source in self.sources:
+            _, accounts = self.accounts(source)
+            variables = self._variables(source, 'master', '1', accounts)
+            pages = variables['total_pages'] if variables else 0
+            lines.append(f'<h2>{html.escape(source)}</h2><p>Master list: ')
+            lines += [f'<a href="/{source}/master/{page}.pdf">{page}</a>' for page in range(1, pages + 1)]
+            lines.append('</p><ul>')
+            lines += [f'<li><a href="/{source}/sheet/{urllib.parse.quote(username)}.pdf">'
+                      f'{html.escape(username)}</a> ({html.escape(account.name or "")})</li>'
+                      for username, account in accounts.items()]
+            lines.append('</ul>')
+        lines.append('</body></html>')
+        return '\n'.join(lines)
+
+    async def handle(self, reader: 'asyncio.StreamReader', writer: 'asyncio.StreamWriter') -> None:
+        status, content_type, body = '404 Not Found', 'text/plain', b'Not found\n'
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()).strip():
+                # Skip the headers
+                pass
+
+            if len(request_line) < 2 or request_line[0] != 'GET':
+                status, body = '405 Method Not Allowed', b'Only GET is supported\n'
+            else:
+                path = urllib.parse.unquote(urllib.parse.urlsplit(request_line[1]).path)
+                parts = path.strip('/').split('/')
+                if path == '/':
+                    index = await asyncio.get_running_loop().run_in_executor(self._executor, self.index)
+                    status, content_type, body = '200 OK', 'text/html; charset=utf-8', index.encode()
+                elif len(parts) == 3 and parts[0] in self.sources and parts[1] in ('sheet', 'master') \
+                        and parts[2].endswith('.pdf'):
+                    pdf = await self.pdf(parts[0], parts[1], parts[2][:-len('.pdf')])
+                    if pdf is not None:
+                        status, content_type, body = '200 OK', 'application/pdf', pdf
+        except (Exception, SystemExit) as e:
+            # Loading the accounts exits on invalid input files, which should not stop the server
+            print(f'Error handling request: {type(e).__name__}: {e}', file=sys.stderr)
+            status, content_type, body = '500 Internal Server Error', 'text/plain', b'Internal server error\n'
+
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n'
+                     f'Cache-Control: no-store\r\nConnection: close\r\n\r\n'.encode() + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        # Compile the templates and import the lazily imported packages before rendering in multiple threads, since lazy
+        # imports are not thread safe
+        for template in ('ccs-and-challenge-sheets.html', 'ccs-and-challenge-master.html'):
+            load_template(template)
+        if pdfkit is not None:
+            getattr(pdfkit, 'from_file')
+
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f'Serving password sheets for {", ".join(self.sources)} on http://{host}:{port}/. Press Ctrl+C to stop')
+        async with server:
+            await server.serve_forever()
+
+
+def serve_sheets(config: Config, sources: typing.Sequence[str], port: int = 8000, host: str = 'localhost') -> None:
+    """Serve single password sheets and master list pages of the given sources over HTTP until interrupted"""
+
+    unsupported = [source for source in sources if not SheetServer.supports(source)]
+    if unsupported:
+        print(f'Can not serve sheets for {", ".join(unsupported)}, only for contests and the challenge')
+        exit(1)
+
+    try:
+        asyncio.run(SheetServer(config, sources).serve(host, port))
+    except KeyboardInterrupt:
+        print('Stopped serving')
+
+
+def _file_state(file: str) -> typing.Optional[typing.Tuple[int, int]]:
+    try:
+        stat = os.stat(file)
+        return stat.st_size, stat.st_mtime_ns
+    except OSError:
+        return None
+
+
+def watch_sources(config: Config, sources: typing.Sequence[str], interval: float = 1.0,
+                  debounce: float = 0.5) -> None:
+    """Generate the given sources and keep regenerating them whenever one of their input files changes.
+
+    This keeps running until interrupted, so the imports, word list and templates stay loaded between runs. The input
+    files per source come from the build manifest, which also makes sure only the outputs that depend on the changed
+    files are rebuilt. A burst of changes results in one rebuild, since rebuilding waits until no files changed for
+    `debounce` seconds. When the config or a contest.yaml changes, the config is loaded again."""
+
+    if not config.global_config.cache_folder:
+        print('Watch mode needs a cache folder to keep track of the inputs of every source')
+        exit(1)
+
+    def build(to_build: typing.Iterable[str]) -> None:
+        for source in to_build:
+            try:
+                generate_source(config, source)
+            except SystemExit as e:
+                print(f'Source {source} failed: exited with code {e.code}', file=sys.stderr)
+            except Exception as e:
+                print(f'Source {source} failed: {type(e).__name__}: {e}', file=sys.stderr)
+
+    def watched() -> typing.Dict[str, typing.Set[str]]:
+        return {source: BuildManifest(config.global_config.cache_folder, source).input_files() for source in sources}
+
+    def outputs() -> typing.Set[str]:
+        return {output for source in sources
+                for output in BuildManifest(config.global_config.cache_folder, source).outputs}
+
+    build(sources)
+    files = watched()
+    state = {file: _file_state(file) for source_files in files.values() for file in source_files}
+    print(f'Watching {len(state)} files for {", ".join(sources)}. Press Ctrl+C to stop')
+
+    try:
+        while True:
+            time.sleep(interval)
+            current = {file: _file_state(file) for file in state}
+            if current == state:
+                continue
+
+            # Wait for the changes to settle, so a burst of edits only results in a single rebuild
+            settled = current
+            while True:
+                time.sleep(debounce)
+                current = {file: _file_state(file) for file in state}
+                if current == settled:
+                    break
+                settled = current
+
+            changed = {file for file in state if current[file] != state[file]}
+            print(f'Changed: {", ".join(sorted(changed))}')
+            if any(file == 'config.yaml' or os.path.basename(file) == 'contest.yaml' for file in changed):
+                config = load_config()
+            build(source for source in sources if files[source] & changed)
+
+            # Outputs of the rebuild can be inputs as well, so use their new state. For other files use the state of
+            # before the rebuild, so changes made while rebuilding are picked up by the next round
+            files = watched()
+            generated = outputs()
+            state = {file: current[file] if file in current and file not in generated else _file_state(file)
+                     for source_files in files.values() for file in source_files}
+    except KeyboardInterrupt:
+        print('Stopped watching')
+
+
+def _generate_source_timed(config: Config, source: str, overwrite: bool, dry_run: bool = False,
+                           profile: bool = False,
+                           account_filter: typing.Optional[AccountFilter] = None) -> typing.Tuple[float, list]:
+    if profile:
+        profiler.enable()
+    start = time.monotonic()
+    generate_source(config, source, overwrite, dry_run, account_filter)
+    return time.monotonic() - start, profiler.spans if profile else []
+
+
+@profiled()
+def generate_sources(config: Config, sources: typing.Sequence[str], overwrite: bool = False,
+                     jobs: typing.Optional[int] = None, dry_run: bool = False,
+                     account_filter: typing.Optional[AccountFilter] = None) -> typing.Dict[str, typing.Optional[str]]:
+    """Generate all given sources, using a process per source.
+
+    Additional account files are generated first, since contests read them. The other sources do not depend on each
+    other and are generated concurrently. A failing source does not stop the others. Returns the error per source, or
+    None for sources that were generated successfully."""
+
+    results: typing.Dict[str, typing.Optional[str]] = {}
+
+    def handle(source: str, future: concurrent.futures.Future) -> None:
+        try:
+            duration, spans = future.result()
+            profiler.add_spans(spans, source=source)
+            results[source] = None
+            print(f'Source {source} done in {duration:.1f}s')
+        except SystemExit as e:
+            results[source] = f'exited with code {e.code}'
+        except Exception as e:
+            results[source] = f'{type(e).__name__}: {e}'
+        if results[source]:
+            print(f'Source {source} failed: {results[source]}', file=sys.stderr)
+
+    file_sources = [source for source in sources if source.startswith('file ')]
+    other_sources = [source for source in sources if not source.startswith('file ')]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs or max(len(other_sources), 1)) as executor:
+        for source in file_sources:
+            handle(source, executor.submit(_generate_source_timed, config, source, overwrite, dry_run,
+                                           profiler.enabled, account_filter))
+
+        futures = {executor.submit(_generate_source_timed, config, source, overwrite, dry_run,
+                                   profiler.enabled, account_filter): source
+                   for source in other_sources}
+        for future in concurrent.futures.as_completed(futures):
+            handle(futures[future], future)
+
+    return {source: results[source] for source in sources}
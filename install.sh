@@ -3,4 +3,4 @@
 # Purpose: install required python modules
 #
 
-sudo apt install python3-yaml python3-pip python3-jinja2 python3-pdfkit xkcdpass wkhtmltopdf
+sudo apt install python3-yaml python3-pip python3-jinja2 python3-pdfkit python3-pypdf python3-pil xkcdpass wkhtmltopdf
@@ -0,0 +1,718 @@
+import asyncio
+import csv
+import json
+import os
+import shutil
+import sys
+import typing
+
+import pytest
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_FOLDER)
+
+import icpcpwutils  # noqa: E402
+from icpcpwutils import Account, AccountFilter, AccountStore, BuildManifest, NativePdfBackend, PasswordKey  # noqa: E402
+
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet']
+
+
+def test_manifest_key_changes_with_inputs(tmp_path):
+    input_file = tmp_path / 'input.txt'
+    input_file.write_text('one')
+    manifest = BuildManifest(str(tmp_path / 'cache'), 'test')
+    key = manifest.key([str(input_file)], ['value'])
+    assert manifest.key([str(input_file)], ['value']) == key
+    assert manifest.key([str(input_file)], ['other value']) != key
+    input_file.write_text('two')
+    assert manifest.key([str(input_file)], ['value']) != key
+    # Nested keys carry over their input files
+    assert manifest.inputs[manifest.key([], [key])] == [str(input_file)]
+
+
+def test_manifest_output_is_current_until_touched(tmp_path):
+    output_file = tmp_path / 'output.txt'
+    output_file.write_text('output')
+    manifest = BuildManifest(str(tmp_path / 'cache'), 'test')
+    manifest.record({str(output_file): 'key'})
+
+    manifest = BuildManifest(str(tmp_path / 'cache'), 'test')
+    assert manifest.is_current(str(output_file), 'key')
+    assert not manifest.is_current(str(output_file), 'other key')
+    output_file.write_text('changed output')
+    assert not manifest.is_current(str(output_file), 'key')
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """A copy of the first sample, with the working directory set to its gen folder"""
+
+    shutil.copytree(f'{REPO_FOLDER}/sample/test01', tmp_path / 'test01')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg-cache'))
+    monkeypatch.chdir(tmp_path / 'test01' / 'gen')
+    return tmp_path / 'test01'
+
+
+def generate_finals(capsys, account_filter: icpcpwutils.AccountFilter = None) -> str:
+    icpcpwutils.generate_contest(icpcpwutils.load_config(), 'finals', account_filter=account_filter)
+    return capsys.readouterr().out
+
+
+def test_contest_is_up_to_date_until_an_input_changes(workspace, capsys):
+    assert 'Written password sheets' in generate_finals(capsys)
+    assert generate_finals(capsys).strip() == 'All files for finals are up to date'
+
+    teams_file = workspace / 'contests' / 'finals' / 'teams.json'
+    teams = json.loads(teams_file.read_text())
+    teams[0]['display_name'] += ' (renamed)'
+    teams_file.write_text(json.dumps(teams))
+    output = generate_finals(capsys)
+    assert 'Written password sheets' in output
+    assert 'Written master file' in output
+
+
+def test_contest_repairs_deployed_files(workspace, capsys):
+    generate_finals(capsys)
+    deployed = workspace / 'contests' / 'finals' / 'accounts.yaml'
+    generated = workspace / 'gen' / 'finals' / 'finals.accounts.yaml'
+    deployed.unlink()
+
+    output = generate_finals(capsys)
+    assert 'All files for finals are up to date' in output
+    assert 'YAML deployed to' in output
+    assert deployed.read_text() == generated.read_text()
+    assert 'deployed' not in generate_finals(capsys)
+
+
+def test_password_key_is_deterministic():
+    key = PasswordKey(b'secret', 1, 'finals')
+    password = key.derive('team1', 3, WORDS)
+    assert password == PasswordKey(b'secret', 1, 'finals').derive('team1', 3, WORDS)
+    assert len(password.split('-')) == 3
+    assert all(word in WORDS for word in password.split('-'))
+    assert len(key.derive('team1', 5, WORDS).split('-')) == 5
+
+
+def test_password_key_depends_on_all_inputs():
+    password = PasswordKey(b'secret', 1, 'finals').derive('team1', 6, WORDS)
+    assert PasswordKey(b'secret', 1, 'finals').derive('team2', 6, WORDS) != password
+    assert PasswordKey(b'other secret', 1, 'finals').derive('team1', 6, WORDS) != password
+    assert PasswordKey(b'secret', 1, 'challenge').derive('team1', 6, WORDS) != password
+
+
+def test_password_key_version_bump_changes_passwords():
+    old = PasswordKey(b'secret', 1, 'finals')
+    new = PasswordKey(b'secret', 2, 'finals')
+    changed = [old.derive(f'team{n}', 4, WORDS) != new.derive(f'team{n}', 4, WORDS) for n in range(20)]
+    assert all(changed)
+
+
+def test_password_key_load(tmp_path):
+    key_file = tmp_path / 'password.key'
+    key_file.write_bytes(b'secret\n')
+    assert PasswordKey.load(str(key_file), 2, 'finals').derive('team1', 3, WORDS) == \
+        PasswordKey(b'secret', 2, 'finals').derive('team1', 3, WORDS)
+
+
+def make_account(username: str, team_id: str = None, ip: str = None, organization: str = None,
+                 type: str = 'team', name: str = None) -> Account:
+    account = Account(username, name or username, type, username, team_id, ip, 'some-password')
+    account.organization = organization
+    return account
+
+
+@pytest.fixture
+def accounts() -> AccountStore:
+    return AccountStore([
+        make_account('team1', '1', '10.0.0.1', 'Delft'),
+        make_account('team10', '10', '10.0.0.10', 'Utrecht'),
+        make_account('team12', '12', '10.0.1.12', 'Delft'),
+        make_account('team2', '2', '10.0.1.2', 'Leiden'),
+        make_account('coach10', '10', None, 'Utrecht', 'coach'),
+        make_account('judge1', type='judge'),
+    ])
+
+
+def usernames(accounts: AccountStore) -> list:
+    return list(accounts.keys())
+
+
+def test_account_store_indexes_follow_inserts_and_removals(accounts):
+    assert accounts.by_team_id('10').username == 'coach10'
+    del accounts['coach10']
+    assert accounts.by_team_id('10').username == 'team10'
+    assert [account.username for account in accounts.by_organization('Utrecht')] == ['team10']
+
+    del accounts['team10']
+    assert accounts.by_team_id('10') is None
+    assert accounts.by_ip('10.0.0.10') is None
+    assert 'Utrecht' not in accounts.organizations()
+
+    accounts.upsert(make_account('team1', '1', '10.0.2.1', 'Leiden'))
+    assert accounts.by_ip('10.0.0.1') is None
+    assert accounts.by_ip('10.0.2.1').username == 'team1'
+    assert [account.username for account in accounts.by_organization('Leiden')] == ['team2', 'team1']
+    assert usernames(accounts)[0] == 'team1'
+
+    accounts.amend('team12', team_id='13', organization='Leiden')
+    assert accounts.by_team_id('12') is None
+    assert accounts.by_team_id('13').username == 'team12'
+    assert accounts.organizations() == ['Leiden']
+
+    with pytest.raises(KeyError):
+        accounts['team3'] = make_account('team4')
+
+def test_filter_without_conditions_is_none():
+    assert AccountFilter.parse() is None
+    assert AccountFilter.parse([], []) is None
+
+
+def test_filter_username_globs(accounts):
+    assert usernames(AccountFilter.parse(['team1']).select(accounts)) == ['team1']
+    assert usernames(AccountFilter.parse(['team1*']).select(accounts)) == ['team1', 'team10', 'team12']
+    assert usernames(AccountFilter.parse(['team2,judge*']).select(accounts)) == ['team2', 'judge1']
+    # Multiple patterns must all match
+    assert usernames(AccountFilter.parse(['team*', '*2']).select(accounts)) == ['team12', 'team2']
+
+
+def test_filter_team_id_range(accounts):
+    account_filter = AccountFilter.parse(where=['team_id=2-10'])
+    assert usernames(account_filter.select(accounts)) == ['team10', 'team2', 'coach10']
+    assert not account_filter.matches(accounts['judge1'])
+    # A range only applies to team IDs, for other fields it is a plain value
+    assert usernames(AccountFilter.parse(where=['name=2-10']).select(accounts)) == []
+
+
+def test_filter_ip_subnet(accounts):
+    assert usernames(AccountFilter.parse(where=['ip=10.0.1.0/24']).select(accounts)) == ['team12', 'team2']
+    assert usernames(AccountFilter.parse(where=['ip=10.0.0.1']).select(accounts)) == ['team1']
+    assert usernames(AccountFilter.parse(where=['ip=10.0.0.1*']).select(accounts)) == ['team1', 'team10']
+
+
+def test_filter_combines_conditions(accounts):
+    account_filter = AccountFilter.parse(['team*'], ['organization=Delft,Utrecht', 'type=team'])
+    assert usernames(account_filter.select(accounts)) == ['team1', 'team10', 'team12']
+    assert account_filter.description() == 'username=team* organization=Delft,Utrecht type=team'
+
+
+def test_filter_rejects_invalid_conditions(capsys):
+    with pytest.raises(SystemExit):
+        AccountFilter.parse(where=['shoe_size=42'])
+    assert 'Invalid filter shoe_size=42' in capsys.readouterr().out
+    with pytest.raises(SystemExit):
+        AccountFilter.parse(where=['ip=10.0.0.300'])
+    assert 'Invalid IP address or subnet' in capsys.readouterr().out
+
+
+def test_filter_suffixes_are_unique():
+    suffixes = {AccountFilter.parse([only]).suffix() for only in ['team1', 'team1*', 'team1?', 'team1,team2']}
+    assert len(suffixes) == 4
+    assert AccountFilter.parse(['team1']).suffix().startswith('username=team1-')
+    assert AccountFilter.parse(['team1']).suffix() == AccountFilter.parse(['team1']).suffix()
+
+
+def test_contest_filter_is_part_of_the_manifest(workspace, capsys):
+    team1 = AccountFilter.parse(['team1'])
+    team1_glob = AccountFilter.parse(['team1*'])
+
+    assert f'finals_password_sheets-{team1.suffix()}.pdf' in generate_finals(capsys, team1)
+    assert f'finals_password_sheets-{team1_glob.suffix()}.pdf' in generate_finals(capsys, team1_glob)
+    assert 'All files for finals are up to date' in generate_finals(capsys, team1_glob)
+    assert os.path.isfile(f'finals/finals_password_sheets-{team1.suffix()}.pdf')
+
+
+def test_contest_filter_regenerates_accounts_from_additional_files(workspace, capsys):
+    generate_finals(capsys)
+    before = icpcpwutils.yaml.safe_load(open('finals/finals.accounts.yaml'))
+    # The judge is only in the additional account file, not yet in the accounts file of the contest
+    icpcpwutils.write_yaml_records('other-accounts.yaml', [{'username': 'judge1', 'type': 'judge', 'password': 'a b'}])
+
+    icpcpwutils.generate_contest(icpcpwutils.load_config(), 'finals', overwrite=True,
+                                 account_filter=AccountFilter.parse(where=['type=judge']))
+    assert 'Generated new passwords for 1 accounts' in capsys.readouterr().out
+    after = icpcpwutils.yaml.safe_load(open('finals/finals.accounts.yaml'))
+    assert [account['username'] for account in after] == [account['username'] for account in before] + ['judge1']
+    assert [account for account in after if account['type'] == 'team'] == \
+        [account for account in before if account['type'] == 'team']
+    assert [account['password'] for account in after if account['username'] == 'judge1'] != ['a b']
+
+
+def test_contest_filter_rejects_organizations(workspace, capsys):
+    with pytest.raises(SystemExit):
+        generate_finals(capsys, AccountFilter.parse(where=['organization=MIT']))
+    assert 'Contest accounts do not have an organization' in capsys.readouterr().out
+
+def test_native_backend_supports_windows_1252_text_only():
+    backend = NativePdfBackend()
+    sheets = 'ccs-and-challenge-sheets.html'
+    assert backend.supports(sheets, {'accounts': [make_account('team1', name='Université de Genève')]}, 'A4')
+    assert not backend.supports(sheets, {'accounts': [make_account('team1', name='北京大学')]}, 'A4')
+    assert not backend.supports(sheets, {'accounts': [make_account('team1')], 'footer': 'Ελλάδα'}, 'A4')
+    assert not backend.supports(sheets, {'accounts': [make_account('team1')]}, 'B5')
+    assert not backend.supports('custom.html', {'accounts': [make_account('team1')]}, 'A4')
+
+
+def test_native_backend_skips_modified_templates(tmp_path, monkeypatch, capsys):
+    for template in NativePdfBackend.shipped_templates:
+        shutil.copy(f'{REPO_FOLDER}/templates/{template}', tmp_path / template)
+    monkeypatch.setattr(icpcpwutils, 'template_path', lambda template_file: str(tmp_path / template_file))
+    backend = NativePdfBackend()
+    sheet_variables = {'accounts': [make_account('team1')]}
+    assert backend.supports('ccs-and-challenge-sheets.html', sheet_variables, 'A4')
+
+    with open(tmp_path / 'ccs-and-challenge-sheets.html', 'a') as template:
+        template.write('<p>Good luck!</p>\n')
+    assert not backend.supports('ccs-and-challenge-sheets.html', sheet_variables, 'A4')
+    assert 'was modified' in capsys.readouterr().err
+    assert backend.supports('ccs-and-challenge-master.html', {'pages': []}, 'A4')
+
+
+
+def test_native_backend_digests_match_the_shipped_templates():
+    assert {template: icpcpwutils.file_digest(f'{REPO_FOLDER}/templates/{template}')
+            for template in NativePdfBackend.shipped_templates} == NativePdfBackend.shipped_templates
+    assert set(NativePdfBackend.shipped_templates) == set(NativePdfBackend().layouts)
+
+
+@pytest.mark.parametrize('mode,transparency,supported', [
+    ('RGB', None, True),
+    ('P', None, True),
+    ('P', 0, False),
+    ('RGB', (255, 255, 255), False),
+    ('RGBA', None, False),
+])
+def test_native_backend_embeds_png_banners_without_transparency(tmp_path, mode, transparency, supported):
+    image = pytest.importorskip('PIL.Image').new(mode, (4, 2))
+    if mode == 'P':
+        # A full palette, so the image is saved with 8 bits per pixel
+        image.putpalette(bytes(range(256)) * 3)
+    banner = str(tmp_path / 'banner.png')
+    image.save(banner, **({'transparency': transparency} if transparency is not None else {}))
+
+    sheet_variables = {'accounts': [make_account('team1')], 'banner': banner}
+    assert NativePdfBackend().supports('ccs-and-challenge-sheets.html', sheet_variables, 'A4') == supported
+
+@pytest.fixture
+def challenge_workspace(workspace):
+    """The sample workspace with challenge participants, coaches without Linux accounts and their organizations"""
+
+    teams = json.loads((workspace / 'contests' / 'finals' / 'teams.json').read_text())
+    challenge_folder = workspace / 'gen' / 'icpc-challenge'
+    challenge_folder.mkdir()
+    (challenge_folder / 'icpc-challenge-participants.json').write_text(json.dumps(teams))
+    (challenge_folder / 'icpc-challenge-coaches.json').write_text(json.dumps([
+        {'id': team['id'], 'name': f'Coach {team["id"]}', 'organization_id': team['organization_id']}
+        for team in teams]))
+    (challenge_folder / 'organizations.json').write_text(json.dumps([
+        {'id': team['organization_id'], 'formal_name': team['display_name']} for team in teams]))
+
+    config_file = workspace / 'gen' / 'config.yaml'
+    config = icpcpwutils.yaml.safe_load(config_file.read_text())
+    config['challenge']['account_files'][1]['linux'] = False
+    del config['challenge']['banner']
+    config_file.write_text(icpcpwutils.yaml.safe_dump(config))
+    return workspace
+
+
+async def http_get(server: icpcpwutils.SheetServer, path: str) -> typing.Tuple[str, bytes]:
+    """Request the given path from the given sheet server and return the status line and body"""
+
+    http_server = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+    async with http_server:
+        reader, writer = await asyncio.open_connection(*http_server.sockets[0].getsockname()[:2])
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return head.decode().splitlines()[0], body
+
+
+def test_sheet_server_joins_challenge_organizations(challenge_workspace, capsys):
+    config = icpcpwutils.load_config()
+    icpcpwutils.generate_challenge(config)
+    generated = icpcpwutils.load_accounts('challenge/challenge.accounts.yaml', 4)
+    teams = json.loads((challenge_workspace / 'contests' / 'finals' / 'teams.json').read_text())
+
+    server = icpcpwutils.SheetServer(config, ['challenge'])
+    _, accounts = server.accounts('challenge')
+    assert list(accounts.keys()) == list(generated.keys())
+    coach = accounts[f'coach{teams[0]["id"]}']
+    assert coach.organization == teams[0]['display_name']
+    assert not coach.linux
+    assert coach.password == generated[coach.username].password
+    assert accounts[f'team{teams[0]["id"]}'].linux
+
+    status, body = asyncio.run(http_get(server, f'/challenge/sheet/{coach.username}.pdf'))
+    assert status == 'HTTP/1.1 200 OK'
+    assert body.startswith(b'%PDF')
+    status, _ = asyncio.run(http_get(server, '/challenge/sheet/nobody.pdf'))
+    assert status == 'HTTP/1.1 404 Not Found'
+
+
+@pytest.mark.parametrize('text', [
+    '[-1.5e10]',
+    '[1, -2.25E-3, 300, 4e+2, true, false, null]',
+    ' [ "a, b", {"id": "12", "nested": [1, 2.5]}, 1234567890 ]\n',
+])
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 4, 5, 7, 64])
+def test_iter_json_array_splits_chunks_anywhere(tmp_path, text, chunk_size):
+    json_file = tmp_path / 'items.json'
+    json_file.write_text(text)
+    assert list(icpcpwutils.iter_json_array(str(json_file), chunk_size)) == json.loads(text)
+
+
+@pytest.mark.parametrize('text', ['{"id": 1}', '[1, 2'])
+def test_iter_json_array_rejects_other_content(tmp_path, capsys, text):
+    json_file = tmp_path / 'items.json'
+    json_file.write_text(text)
+    with pytest.raises(SystemExit):
+        list(icpcpwutils.iter_json_array(str(json_file), 2))
+
+
+def test_yaml_snapshots_are_private_and_reused(tmp_path, monkeypatch):
+    yaml_file = tmp_path / 'accounts.yaml'
+    yaml_file.write_text('- username: team1\n  password: secret\n')
+    cache_folder = str(tmp_path / 'cache')
+    parsed = []
+    get_yaml_file_contests = icpcpwutils.get_yaml_file_contests
+    monkeypatch.setattr(icpcpwutils, 'get_yaml_file_contests', lambda file: parsed.append(file) or
+                        get_yaml_file_contests(file))
+
+    content = [{'username': 'team1', 'password': 'secret'}]
+    assert icpcpwutils.get_yaml_file_cached(str(yaml_file), cache_folder) == content
+    snapshots = list((tmp_path / 'cache' / 'yaml').iterdir())
+    assert [snapshot.suffix for snapshot in snapshots] == ['.marshal']
+    assert snapshots[0].stat().st_mode & 0o777 == 0o600
+    assert icpcpwutils.get_yaml_file_cached(str(yaml_file), cache_folder) == content
+    assert len(parsed) == 1
+
+    # Snapshots others can read or write are not trusted
+    snapshots[0].chmod(0o644)
+    assert icpcpwutils.get_yaml_file_cached(str(yaml_file), cache_folder) == content
+    assert len(parsed) == 2
+    assert snapshots[0].stat().st_mode & 0o777 == 0o600
+
+
+def test_atomic_write_keeps_permissions(tmp_path):
+    target = tmp_path / 'accounts.yaml'
+    with icpcpwutils.atomic_write(str(target)) as f:
+        f.write('first')
+    target.chmod(0o600)
+    with icpcpwutils.atomic_write(str(target)) as f:
+        f.write('second')
+    assert target.read_text() == 'second'
+    assert target.stat().st_mode & 0o777 == 0o600
+
+    with icpcpwutils.atomic_write(str(target), permissions=0o640) as f:
+        f.write('third')
+    assert target.stat().st_mode & 0o777 == 0o640
+    assert [file.name for file in tmp_path.iterdir()] == ['accounts.yaml']
+
+
+def test_atomic_write_keeps_old_file_on_errors(tmp_path):
+    target = tmp_path / 'accounts.yaml'
+    target.write_text('old')
+    with pytest.raises(RuntimeError):
+        with icpcpwutils.atomic_write(str(target)) as f:
+            f.write('new')
+            raise RuntimeError('Failed')
+    assert target.read_text() == 'old'
+    assert [file.name for file in tmp_path.iterdir()] == ['accounts.yaml']
+
+
+@pytest.mark.parametrize('method', ['copy', 'hardlink', 'symlink'])
+def test_deploy_file_keeps_permissions(tmp_path, method):
+    source = tmp_path / 'accounts.yaml'
+    target = tmp_path / 'contest' / 'accounts.yaml'
+    target.parent.mkdir()
+    with icpcpwutils.atomic_write(str(source), permissions=0o600) as f:
+        f.write('accounts')
+
+    assert icpcpwutils.deploy_file(str(source), str(target), method) == method
+    assert target.read_text() == 'accounts'
+    assert target.stat().st_mode & 0o777 == 0o600
+    assert target.is_symlink() == (method == 'symlink')
+    assert icpcpwutils.deploy_file(str(source), str(target), method) == 'unchanged'
+
+
+class CountingBackend(icpcpwutils.PdfBackend):
+    """Stands in for wkhtmltopdf, writing a blank page per account and remembering which accounts it rendered"""
+
+    def __init__(self) -> None:
+        self.rendered = []
+
+    def supports(self, template_file: str, sheet_variables: dict, page_size: str) -> bool:
+        return True
+
+    def render(self, template_file: str, sheet_variables: dict, output_file: str, page_size: str,
+               orientation: str) -> None:
+        writer = icpcpwutils.pypdf.PdfWriter()
+        for account in sheet_variables['accounts']:
+            self.rendered.append(account.username)
+            writer.add_blank_page(595, 842)
+        with open(output_file, 'wb') as pdf_file:
+            writer.write(pdf_file)
+
+
+def test_page_cache_reuses_unchanged_pages_and_prunes_the_others(tmp_path, monkeypatch):
+    pypdf = pytest.importorskip('pypdf')
+    backend = CountingBackend()
+    monkeypatch.setitem(icpcpwutils.PDF_BACKENDS, 'wkhtmltopdf', backend)
+    cache_folder = tmp_path / 'pages'
+    output_file = tmp_path / 'sheets.pdf'
+    accounts = [make_account(f'team{n}') for n in range(1, 4)]
+
+    def render() -> None:
+        icpcpwutils.generate_cached_template_to_pdf('ccs-and-challenge-sheets.html', {'accounts': accounts},
+                                                    'accounts', str(output_file), 'A4', str(cache_folder),
+                                                    backend='wkhtmltopdf')
+
+    def cached_pages() -> int:
+        return len(list(cache_folder.glob('*.pdf')))
+
+    render()
+    assert backend.rendered == ['team1', 'team2', 'team3']
+    assert len(pypdf.PdfReader(str(output_file)).pages) == 3
+
+    backend.rendered.clear()
+    accounts[1].password = 'a-new-password'
+    render()
+    assert backend.rendered == ['team2']
+    assert len(pypdf.PdfReader(str(output_file)).pages) == 3
+    assert cached_pages() == 4
+
+    assert icpcpwutils.prune_page_cache(str(cache_folder)) == 1
+    assert cached_pages() == 3
+    backend.rendered.clear()
+    render()
+    assert backend.rendered == []
+
+    # Pages of outputs that were removed are not needed anymore
+    output_file.unlink()
+    assert icpcpwutils.prune_page_cache(str(cache_folder)) == 3
+    assert cached_pages() == 0
+
+
+def test_page_cache_is_not_used_for_native_pages(tmp_path):
+    pytest.importorskip('pypdf')
+    cache_folder = tmp_path / 'pages'
+    icpcpwutils.generate_cached_template_to_pdf('ccs-and-challenge-sheets.html', {'accounts': [make_account('team1')]},
+                                                'accounts', str(tmp_path / 'sheets.pdf'), 'A4', str(cache_folder))
+    assert (tmp_path / 'sheets.pdf').read_bytes().startswith(b'%PDF')
+    assert list(cache_folder.glob('*.pdf')) == []
+
+
+@pytest.fixture
+def export_accounts_list() -> typing.List[Account]:
+    accounts = [make_account(f'team{n}', str(n), f'10.0.0.{n}', name=f'Université {n}\tB') for n in range(1, 6)]
+    accounts.append(make_account('judge1', type='judge', name='Judge, "the" first'))
+    accounts[1].linux = False
+    return accounts
+
+
+def test_export_accounts_round_trips(tmp_path, export_accounts_list):
+    def output(name: str) -> str:
+        return str(tmp_path / name)
+
+    sinks = [
+        icpcpwutils.YamlAccountsSink(output('accounts.yaml')),
+        icpcpwutils.TsvAccountsSink(output('accounts.tsv')),
+        icpcpwutils.LinuxAccountsSink(output('linux-accounts.yaml')),
+        icpcpwutils.CodeforcesSink(output('codeforces.csv')),
+        icpcpwutils.CcsAccountsJsonSink(output('accounts.json')),
+        icpcpwutils.JsonLinesSink(output('accounts.jsonl')),
+    ]
+    icpcpwutils.export_accounts(export_accounts_list, sinks, per_chunk=2)
+    accounts = export_accounts_list
+
+    assert icpcpwutils.yaml.safe_load(open(output('accounts.yaml'))) == [account.to_yaml_dict() for account in accounts]
+    assert [account.password for account in icpcpwutils.load_accounts(output('accounts.yaml'), 3).values()] == \
+        [account.password for account in accounts]
+
+    with open(output('accounts.tsv'), newline='') as tsv_file:
+        rows = list(csv.reader(tsv_file, delimiter='\t'))
+    assert rows == [['accounts', '1']] + [[account.type, account.name, account.username, account.password]
+                                         for account in accounts]
+
+    assert icpcpwutils.yaml.safe_load(open(output('linux-accounts.yaml'))) == {
+        'users': {account.username: account.password for account in accounts if account.linux}}
+
+    with open(output('codeforces.csv'), newline='', encoding='utf-8-sig') as csv_file:
+        rows = list(csv.reader(csv_file))
+    assert rows[0] == ['team id', 'display name', 'login', 'password']
+    assert rows[1] == ['1', accounts[0].name, 'team1', accounts[0].password]
+    assert rows[-1] == ['', accounts[-1].name, 'judge1', accounts[-1].password]
+
+    ccs_accounts = json.load(open(output('accounts.json')))
+    assert [account['username'] for account in ccs_accounts] == [account.username for account in accounts]
+    assert ccs_accounts[0] == {'id': 'team1', 'username': 'team1', 'password': accounts[0].password, 'type': 'team',
+                               'name': accounts[0].name, 'team_id': '1', 'ip': '10.0.0.1'}
+    assert 'team_id' not in ccs_accounts[-1]
+
+    lines = [json.loads(line) for line in open(output('accounts.jsonl'))]
+    assert [line['username'] for line in lines] == [account.username for account in accounts]
+    assert lines[1]['linux'] is False
+    assert 'ip' not in lines[-1]
+
+
+def test_export_accounts_writes_empty_files(tmp_path):
+    sinks = [icpcpwutils.YamlAccountsSink(str(tmp_path / 'accounts.yaml')),
+             icpcpwutils.LinuxAccountsSink(str(tmp_path / 'linux-accounts.yaml')),
+             icpcpwutils.CcsAccountsJsonSink(str(tmp_path / 'accounts.json'))]
+    icpcpwutils.export_accounts([], sinks)
+    assert icpcpwutils.yaml.safe_load(open(tmp_path / 'accounts.yaml')) == []
+    assert icpcpwutils.yaml.safe_load(open(tmp_path / 'linux-accounts.yaml')) == {'users': {}}
+    assert json.load(open(tmp_path / 'accounts.json')) == []
+
+
+class FailingSink(icpcpwutils.ExportSink):
+    def write(self, file: typing.IO, accounts: typing.List[Account]) -> None:
+        file.write('partial')
+
+    def end(self, file: typing.IO) -> None:
+        raise RuntimeError('Failed')
+
+
+def test_export_accounts_replaces_nothing_when_a_sink_fails(tmp_path, export_accounts_list):
+    for name in ('accounts.yaml', 'failing.txt'):
+        (tmp_path / name).write_text('old')
+    sinks = [icpcpwutils.YamlAccountsSink(str(tmp_path / 'accounts.yaml')),
+             icpcpwutils.TsvAccountsSink(str(tmp_path / 'accounts.tsv')),
+             FailingSink(str(tmp_path / 'failing.txt'))]
+    with pytest.raises(RuntimeError):
+        icpcpwutils.export_accounts(export_accounts_list, sinks)
+    assert (tmp_path / 'accounts.yaml').read_text() == 'old'
+    assert sorted(file.name for file in tmp_path.iterdir()) == ['accounts.yaml', 'failing.txt']
+
+
+@pytest.mark.parametrize('password,salt,rounds,expected', [
+    ('Hello world!', 'saltstring', 5000,
+     '$6$saltstring$svn8UoSVapNtMuq1ukKS4tPQd8iKwSMHWjl/O817G3uBnIFNjnQJuesI68u4OTLiBFdcbYEdFCoEOfaS35inz1'),
+    ('Hello world!', 'saltstringsaltstring', 10000,
+     '$6$rounds=10000$saltstringsaltst$'
+     'OW1/O6BYHV6BcXZu8QVeXbDWra3Oeqh0sbHbbMCVNSnCM/UrjmM0Dp8vOuZeHBy/YTBmSK6H9qs/y3RnOaw5v.'),
+    ('we have a short salt string but not a short password', 'short', 77777,
+     '$6$rounds=77777$short$WuQyW2YR.hBNpjjRhpYD/ifIw05xdfeEyQoMxIXbkvr0gge1a1x3yRULJ5CCaUeOxFmtlcGZelFl5CxtgfiAc0'),
+])
+def test_sha512_crypt_matches_glibc(password, salt, rounds, expected):
+    assert icpcpwutils._sha512_crypt(password, salt, rounds) == expected
+
+
+def test_hash_password_uses_a_random_salt():
+    hashed = icpcpwutils.hash_password('correct horse battery staple')
+    salt = hashed.split('$')[2]
+    assert len(salt) == 16
+    assert icpcpwutils._sha512_crypt('correct horse battery staple', salt) == hashed
+    assert icpcpwutils.hash_password('correct horse battery staple') != hashed
+
+
+def test_linux_password_hashes_are_cached_per_password(tmp_path, capsys):
+    accounts = AccountStore([make_account('team1'), make_account('team2')])
+    cache_folder = str(tmp_path / 'cache')
+
+    def write_hashes() -> typing.Dict[str, str]:
+        icpcpwutils.write_linux_password_hashes(str(tmp_path), accounts, cache_folder=cache_folder, workers=1)
+        lines = (tmp_path / 'linux-accounts.chpasswd').read_text().splitlines()
+        return dict(line.split(':', 1) for line in lines)
+
+    first = write_hashes()
+    assert '(2 new)' in capsys.readouterr().out
+    assert write_hashes() == first
+    assert '(0 new)' in capsys.readouterr().out
+
+    accounts['team1'].password = 'a new password'
+    second = write_hashes()
+    assert '(1 new)' in capsys.readouterr().out
+    assert second['team2'] == first['team2']
+    assert second['team1'] == icpcpwutils._sha512_crypt('a new password', second['team1'].split('$')[2])
+
+
+@pytest.mark.parametrize('content', ['apple\nbanana\n\ncherry\n', 'apple\r\nbanana\r\n\r\ncherry',
+                                     'apple\nbanana\ncherry'])
+def test_word_pool_reads_the_same_words_with_and_without_mmap(tmp_path, monkeypatch, content):
+    word_file = tmp_path / 'words'
+    word_file.write_bytes(content.encode())
+
+    small = icpcpwutils.WordPool(str(word_file))
+    assert list(small) == ['apple', 'banana', 'cherry']
+    assert small._map is None
+
+    monkeypatch.setattr(icpcpwutils.WordPool, 'mmap_threshold', 0)
+    mapped = icpcpwutils.WordPool(str(word_file))
+    assert list(mapped) == ['apple', 'banana', 'cherry']
+    assert mapped[-1] == 'cherry'
+    assert mapped._words is None
+
+
+def test_word_pool_is_shared_per_file(tmp_path):
+    word_file = tmp_path / 'words'
+    word_file.write_text('apple\n')
+    assert icpcpwutils.WordPool.get(str(word_file)) is icpcpwutils.WordPool.get(os.path.relpath(word_file))
+    assert icpcpwutils.WordPool.get() is not icpcpwutils.WordPool.get(str(word_file))
+
+
+def test_spool_rerun_skips_unchanged_batches(tmp_path, capsys):
+    spool_folder = tmp_path / 'spool'
+    accounts = [make_account(f'team{n}', str(n)) for n in range(1, 6)]
+    account_types = icpcpwutils.AccountTypesConfig(True, {'name': 'DOMjudge'})
+
+    def spool() -> typing.List[str]:
+        sheet_variables = icpcpwutils.password_sheet_variables(accounts, 'Finals', None, None, account_types, 'A4')
+        icpcpwutils.spool_template_to_pdf('ccs-and-challenge-sheets.html', sheet_variables, 'accounts',
+                                          str(spool_folder), 'A4', batch_size=2)
+        return [line for line in capsys.readouterr().out.splitlines() if line.startswith('Spooled')]
+
+    assert len(spool()) == 3
+    assert sorted(os.listdir(spool_folder)) == ['0001.pdf', '0001.pdf.done', '0002.pdf', '0002.pdf.done', '0003.pdf',
+                                                '0003.pdf.done', 'all.done']
+    assert spool() == []
+
+    # An interrupted run leaves a batch without marker, and a changed password changes its batch
+    os.remove(spool_folder / '0003.pdf.done')
+    accounts[2].password = 'a new password'
+    assert spool() == [f'Spooled {spool_folder}/0002.pdf', f'Spooled {spool_folder}/0003.pdf']
+
+    # Batches that are no longer part of the output are removed
+    accounts.pop()
+    assert spool() == []
+    assert sorted(os.listdir(spool_folder)) == ['0001.pdf', '0001.pdf.done', '0002.pdf', '0002.pdf.done', 'all.done']
+
+
+def test_watch_rebuilds_once_per_burst_of_changes(workspace, monkeypatch, capsys):
+    teams_file = workspace / 'contests' / 'finals' / 'teams.json'
+    teams = json.loads(teams_file.read_text())
+
+    def edit(name: str, mtime: int) -> None:
+        teams[0]['display_name'] = name
+        teams_file.write_text(json.dumps(teams))
+        os.utime(teams_file, ns=(mtime, mtime))
+
+    # Every sleep advances a fake clock by running the next step, so the test does not depend on real time
+    steps = [
+        lambda: None,
+        lambda: edit('First edit', 10 ** 18),
+        lambda: edit('Second, longer edit', 10 ** 18 + 1),
+        lambda: None,
+        lambda: None,
+    ]
+    sleeps = []
+
+    def sleep(seconds: float) -> None:
+        sleeps.append(seconds)
+        if not steps:
+            raise KeyboardInterrupt
+        steps.pop(0)()
+
+    built = []
+    generate_source = icpcpwutils.generate_source
+    monkeypatch.setattr(icpcpwutils.time, 'sleep', sleep)
+    monkeypatch.setattr(icpcpwutils, 'generate_source',
+                        lambda config, source: built.append(source) or generate_source(config, source))
+    icpcpwutils.watch_sources(icpcpwutils.load_config(), ['finals'], interval=1, debounce=0.25)
+
+    assert built == ['finals', 'finals']
+    assert sleeps == [1, 1, 0.25, 0.25, 1, 1]
+    out = capsys.readouterr().out
+    assert out.count('Changed: ../contests/finals/teams.json') == 1
+    assert 'Stopped watching' in out